@@ -0,0 +1,50 @@
+from typing import Tuple
+
+import numpy as np
+
+import app_config as cfg
+from timeseries import RingBuffer
+
+
+class AnomalyTracker:
+    """ Flags the samples of a sensor outside of the mean ± k·σ band as they arrive.
+
+    Each update only classifies the samples received since the previous one, against the band at that time.
+    The band comes from the rolling statistics of the buffered window (kept by the ring buffer in O(1)),
+    or from a fixed reference such as the average/std of the sensor. """
+
+    def __init__(self, k: float = cfg.anomaly_k, capacity: int = cfg.anomaly_max_points):
+        self.k: float = k
+        self.last_ts: float = float("-inf")  # Newest sample classified
+        self.outliers: RingBuffer = RingBuffer(capacity)  # Most recent out-of-band samples
+        self.version: int = 0  # Incremented each time outliers are added or dropped
+        self.band: Tuple[float, float] = None  # Lower and upper bounds of the latest update
+
+    def update(self, buffer: RingBuffer, reference: Tuple[float, float] = None) -> Tuple[float, float]:
+        """ Classifies the new samples of the buffer, and returns the current band, or None if it is not known yet.
+        Without a reference, the buffer must track its statistics """
+        if reference is not None:
+            mean, std = reference
+        elif len(buffer) >= cfg.anomaly_min_samples:
+            mean, std = buffer.mean_std()
+        else:
+            mean, std = float("nan"), float("nan")
+        if np.isnan(mean) or np.isnan(std):
+            self.band = None
+            self.last_ts = buffer.last_ts  # Not classified, rather than classified late against another band
+            return None
+        self.band = (mean - self.k * std, mean + self.k * std)
+        first: int = int(np.searchsorted(buffer.timestamps, self.last_ts, side="right"))
+        if first < len(buffer):
+            values: np.ndarray = buffer.values[first:]
+            outside: np.ndarray = (values < self.band[0]) | (values > self.band[1])
+            if outside.any():
+                self.outliers.append(buffer.timestamps[first:][outside], values[outside])
+                self.version += 1
+            self.last_ts = buffer.last_ts
+        return self.band
+
+    def drop_before(self, cutoff_ts: float) -> None:
+        if len(self.outliers) != 0 and self.outliers.timestamps[0] < cutoff_ts:
+            self.outliers.drop_before(cutoff_ts)
+            self.version += 1
@@ -3,17 +3,31 @@ import time
 from typing import List, Dict, Tuple
 from functools import partial
 
+# Reference of the startup times, taken before the heavy imports below
+START_TS: float = time.perf_counter()
+
+import numpy as np
 import pyqtgraph as pg
 from PyQt5 import QtGui, QtWidgets, QtCore
 
-from bookkeeper.sql import create_sessions
-
 import app_config as cfg
 import data_query as dq
+from anomaly import AnomalyTracker
+from fetch_worker import DiscoveryWorker, FetchBatch, FetchWorker
+from frame_scheduler import FrameScheduler
+from instrumentation import stats, start_exporters
+from plot_items import SegmentedCurve, WindowAxis
+from timeseries import RingBuffer, TimeSeriesStore
 
 
 class PlotsWindow(QtGui.QWidget):
-    def __init__(self, _session, _maxIter=100, _profiling=False, _app=None):
+    visibleSensorsChanged = QtCore.pyqtSignal(object)
+    bufferChanged = QtCore.pyqtSignal(int, int)
+    resolutionChanged = QtCore.pyqtSignal(int)
+    nodesLoaded = QtCore.pyqtSignal()
+    plotReleased = QtCore.pyqtSignal(str, str)  # Node and sensor whose samples were dropped
+
+    def __init__(self, _maxIter=100, _profiling=False, _app=None, _nodes: List[str] = None):
         super().__init__()
         self.title: str = "Plots"
         self.left: int = 100
@@ -21,172 +35,456 @@ class PlotsWindow(QtGui.QWidget):
         self.width: int = 600
         self.height: int = 400
         self.buffer: int = 60  # Buffer in seconds
-        self.maxBuffer: int = 600  # Buffer in seconds
-        self.timerTimeout: int = 0  # Timeout in milliseconds
+        self.maxBuffer: int = cfg.max_buffer  # Buffer in seconds
         self.iter: int = 0
         self.maxiter: int = _maxIter
         self.profiling: bool = _profiling
         self.theme: str = "light"
+        self.themed: bool = False  # Plots follow the theme once one was chosen in the settings
         self.curveColor: str = cfg.themes[self.theme]["data_curves"]
         self.attackCurveColor: str = cfg.themes[self.theme]["attack_curves"]
+        self.anomalyCurveColor: str = cfg.themes[self.theme]["anomaly_curves"]
         self.backgroundColor: str = pg.getConfigOption("background")
-        self.session = _session
         self.app = _app
-        self.getNodesAndSensors()
+        self.nodesFilter: List[str] = _nodes  # Only plot these nodes, all of them if None
+        # Discovered in the background once the window is open
+        self.nodes: List[str] = []
+        self.sensors: Dict[str, List[str]] = {}
+        self.discovered: bool = False
+        # Raw samples are only buffered for windows up to raw_window, longer ones are decimated
+        self.store: TimeSeriesStore = TimeSeriesStore(
+            max(cfg.raw_window * cfg.max_sample_rate, 4 * cfg.decimation_buckets),
+            track_stats=cfg.anomaly_bands and cfg.anomaly_reference == "rolling")
+        self.storeGeneration: int = 0  # Incremented each time the store is cleared
+        self.attacks: Dict[str, List[Tuple[float, int]]] = {}
+        self.attacksVersion: Dict[str, int] = {}  # Incremented each time the attacks of a node change
+        self.drawnState: Dict[Tuple[str, str], Tuple[int, int]] = {}  # Window and width each curve was built for
+        self.drawnAttacks: Dict[Tuple[str, str], tuple] = {}  # What the attack markers of each plot were last drawn from
+        self.anomalyBands: bool = cfg.anomaly_bands
+        self.anomalies: Dict[Tuple[str, str], AnomalyTracker] = {}
+        self.drawnAnomalies: Dict[Tuple[str, str], tuple] = {}  # What the band and outliers of each plot were last drawn from
+        # Plots and node grids are created when first shown, and released after staying hidden for a while
+        self.plotHiddenSince: Dict[Tuple[str, str], float] = {}
+        self.nodeHiddenSince: Dict[str, float] = {}
         self.initUI()
+        self.startWorker()
         self.startTimer()
+        self.startDiscovery()
+        self.releaseTimer: QtCore.QTimer = QtCore.QTimer()
+        self.releaseTimer.setInterval(1000)
+        self.releaseTimer.timeout.connect(self.releaseHiddenPlots)
+        self.releaseTimer.start()
+
+    def startWorker(self) -> None:
+        """ Starts the thread fetching the data from the database """
+        self.workerThread: QtCore.QThread = QtCore.QThread()
+        self.worker: FetchWorker = self.createWorker()
+        self.worker.moveToThread(self.workerThread)
+        self.workerThread.started.connect(self.worker.start)
+        self.worker.dataReady.connect(self.receiveData)
+        self.visibleSensorsChanged.connect(self.worker.setVisibleSensors)
+        self.bufferChanged.connect(self.worker.setBuffer)
+        self.resolutionChanged.connect(self.worker.setResolution)
+        self.plotReleased.connect(self.worker.releaseSensor)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.stopWorker)
+        self.workerThread.start()
+        self.visibleSensorsChanged.emit(self.getVisibleSensors())
+
+    def createWorker(self) -> FetchWorker:
+        return FetchWorker(self.buffer)
+
+    def now(self) -> float:
+        """ Returns the timestamp the plotted window ends at """
+        return time.time()
+
+    def stopWorker(self) -> None:
+        QtCore.QMetaObject.invokeMethod(self.worker, "stop", QtCore.Qt.BlockingQueuedConnection)
+        self.workerThread.quit()
+        self.workerThread.wait()
+
+    def receiveData(self, batch: FetchBatch) -> None:
+        """ Stores the samples fetched by the worker. Several batches received between two frames are drawn at once """
+        if batch.generation != self.storeGeneration:
+            return  # Fetched before the store was cleared
+        with stats.timed("gui.store"):
+            self.storeBatch(batch)
+
+    def storeBatch(self, batch: FetchBatch) -> None:
+        # The cached chunks are copied straight from the memory-mapped files into the ring buffers
+        for node in batch.cached.keys():
+            for sensor, chunks in batch.cached[node].items():
+                if sensor not in self.plots.get(node, {}):
+                    continue
+                for timestamps, values in chunks:
+                    if self.store.append(node, sensor, timestamps, values) != 0:
+                        self.scheduler.markDirty()
+        for node in batch.data.keys():
+            for sensor, (timestamps, values) in batch.data[node].items():
+                if sensor not in self.plots.get(node, {}):
+                    continue  # Fetched before the plot was released
+                if batch.replace:
+                    self.store.get(node, sensor).clear()
+                    self.drawnState.pop((node, sensor), None)
+                    self.anomalies.pop((node, sensor), None)
+                    self.drawnAnomalies.pop((node, sensor), None)
+                    self.scheduler.markDirty()
+                if self.store.append(node, sensor, timestamps, values) != 0:
+                    self.scheduler.markDirty()
+        for node, attacks in batch.attacks.items():
+            if attacks != self.attacks.get(node):
+                self.attacks[node] = attacks
+                self.attacksVersion[node] = self.attacksVersion.get(node, 0) + 1
+                self.scheduler.markDirty()
 
     def startTimer(self):
-        self.timer: QtCore.QTimer = QtCore.QTimer()
-        self.timer.setInterval(self.timerTimeout)
-        self.timer.timeout.connect(self.drawPlots)
-        self.timer.start()
+        """ Starts the redraw scheduler, capped at the target FPS """
+        self.scheduler: FrameScheduler = FrameScheduler(self.drawPlots, self.hasVisibleSensors)
+        self.scheduler.start()
 
     def initUI(self) -> None:
         self.setWindowTitle(self.title)
         self.setGeometry(self.left, self.top, self.width, self.height)
 
-        windowLayout = QtWidgets.QVBoxLayout()
-        self.createEmptyPlotsGrid()
-        for node in self.nodes:
-            windowLayout.addWidget(self.nodeGrids[node], stretch=1)
-        self.createAllPlots()
-
-        self.setLayout(windowLayout)
-        self.show()
-
-    def getNodesAndSensors(self):
-        """ Queries the database for the list of all nodes and sensors """
-        self.nodes: List[str] = dq.get_all_nodes()
-        self.nodes.sort()
-        self.sensors: Dict[str, List[str]] = {}
-        for node in self.nodes:
-            tmp_sensors: List[str] = dq.get_all_sensors(node)
-            tmp_sensors.sort()
-            self.sensors[node] = tmp_sensors
-
-    def createEmptyPlotsGrid(self) -> None:
-        """ Creates all the node grids for later plotting """
+        self.windowLayout = QtWidgets.QVBoxLayout()
         self.nodeGrids: Dict[str, pg.GraphicsLayoutWidget] = {}
-        for node in self.nodes:
-            self.nodeGrids[node] = pg.GraphicsLayoutWidget()
-            if not self.profiling:
-                self.nodeGrids[node].hide()
-
-    def createAllPlots(self) -> None:
-        self.plots: Dict[str, Dict[str, pg.PlotWidget]] = {}
-        self.curves: Dict[str, Dict[str, pg.PlotDataItem]] = {}
-        self.attack_curves: Dict[str, Dict[str, List[pg.InfiniteLine]]] = {}
-        for i, node in enumerate(self.nodes):
-            self.plots[node] = {}
-            self.curves[node] = {}
-            self.attack_curves[node] = {}
-            for j, sensor in enumerate(self.sensors[node]):
-                name: str = "%s/%s" % (node, sensor)
-                plot = pg.PlotItem(title=name)
-                plot.enableAutoRange("x", False)
-                plot.enableAutoRange("y", True)
-                curve = plot.plot(name=name, pen=pg.mkPen(self.curveColor, width=3))
-                if not self.profiling:
-                    plot.hide()
-                self.plots[node][sensor] = plot
-                self.curves[node][sensor] = curve
-                self.attack_curves[node][sensor] = []
-                self.nodeGrids[node].addItem(plot)
+        self.plots: Dict[str, Dict[str, pg.PlotItem]] = {}
+        self.curves: Dict[str, Dict[str, SegmentedCurve]] = {}
+        self.attack_curves: Dict[str, Dict[str, pg.PlotDataItem]] = {}
+        self.band_curves: Dict[str, Dict[str, pg.PlotDataItem]] = {}
+        self.outlier_curves: Dict[str, Dict[str, pg.PlotDataItem]] = {}
+        self.loadingLabel: QtWidgets.QLabel = QtWidgets.QLabel("Loading the nodes...")
+        self.loadingLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.windowLayout.addWidget(self.loadingLabel)
+
+        self.setLayout(self.windowLayout)
+        self.show()
+        # Runs once the window was painted for the first time
+        QtCore.QTimer.singleShot(0, self.firstWindowShown)
+
+    def firstWindowShown(self) -> None:
+        elapsed: float = (time.perf_counter() - START_TS) * 1000.
+        stats.record("startup.first_window", elapsed)
+        if self.profiling:
+            print("Window shown after %.0f ms" % elapsed, file=sys.stderr)
+
+    def startDiscovery(self) -> None:
+        """ Starts loading the nodes and sensors in the background """
+        self.discoveryThread: QtCore.QThread = QtCore.QThread()
+        self.discoveryWorker: DiscoveryWorker = DiscoveryWorker()
+        self.discoveryWorker.moveToThread(self.discoveryThread)
+        self.discoveryThread.started.connect(self.discoveryWorker.run)
+        self.discoveryWorker.discovered.connect(self.nodesDiscovered)
+        self.discoveryWorker.discovered.connect(self.discoveryThread.quit)
+        self.discoveryWorker.failed.connect(self.discoveryFailed)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.stopDiscovery)
+        self.discoveryThread.start()
+
+    def stopDiscovery(self) -> None:
+        """ Waits for a query in progress, so that the thread is not destroyed while running """
+        self.discoveryThread.quit()
+        self.discoveryThread.wait()
+
+    def discoveryFailed(self, error: str) -> None:
+        """ Displays the error and tries again later """
+        print("Loading the nodes failed: %s" % error, file=sys.stderr)
+        self.loadingLabel.setText("Loading the nodes failed, retrying...")
+        QtCore.QTimer.singleShot(cfg.discovery_retry_interval, partial(
+            QtCore.QMetaObject.invokeMethod, self.discoveryWorker, "run", QtCore.Qt.QueuedConnection))
+
+    def nodesDiscovered(self, sensors: Dict[str, List[str]]) -> None:
+        """ Called with the sensors of every node once they are loaded """
+        nodes: List[str] = list(sensors.keys())
+        if self.nodesFilter is not None:
+            nodes = [node for node in nodes if node in self.nodesFilter]
+        self.nodes = sorted(nodes)
+        self.sensors = {node: sorted(sensors[node]) for node in self.nodes}
+        self.discovered = True
+        self.windowLayout.removeWidget(self.loadingLabel)
+        self.loadingLabel.deleteLater()
+        elapsed: float = (time.perf_counter() - START_TS) * 1000.
+        stats.record("startup.nodes_loaded", elapsed)
+        if self.profiling:
+            print("%d nodes loaded after %.0f ms" % (len(self.nodes), elapsed), file=sys.stderr)
+            # Profile with all the plots shown
+            for node in self.nodes:
+                for sensor in self.sensors[node]:
+                    self.createPlot(node, sensor)
+            self.updateLayout()
+        self.nodesLoaded.emit()
+
+    def createNodeGrid(self, node: str) -> pg.GraphicsLayoutWidget:
+        """ Creates the grid of a node, placed in the window in the order of the nodes """
+        grid: pg.GraphicsLayoutWidget = pg.GraphicsLayoutWidget()
+        if not self.profiling:
+            grid.hide()
+        if self.themed:
+            grid.setBackground(cfg.themes[self.theme]["background"])
+        index: int = len([n for n in self.nodeGrids.keys() if n < node])
+        self.windowLayout.insertWidget(index, grid, stretch=1)
+        self.nodeGrids[node] = grid
+        self.plots[node] = {}
+        self.curves[node] = {}
+        self.attack_curves[node] = {}
+        self.band_curves[node] = {}
+        self.outlier_curves[node] = {}
+        return grid
+
+    def createPlot(self, node: str, sensor: str) -> pg.PlotItem:
+        if node not in self.nodeGrids:
+            self.createNodeGrid(node)
+        name: str = "%s/%s" % (node, sensor)
+        plot = pg.PlotItem(title=name, axisItems={"bottom": WindowAxis(orientation="bottom")})
+        plot.enableAutoRange("x", False)
+        plot.enableAutoRange("y", True)
+        curve = SegmentedCurve(plot, pg.mkPen(self.curveColor, width=3))
+        # All the attack markers of a plot are drawn by a single item, as disconnected vertical segments
+        attack_curve = plot.plot(pen=pg.mkPen(self.attackCurveColor, width=3), connect="pairs")
+        # Lower and upper bounds of the anomaly band as two horizontal segments, and the samples received outside of it
+        band_curve = plot.plot(pen=pg.mkPen(self.anomalyCurveColor, width=1, style=QtCore.Qt.DashLine), connect="pairs")
+        outlier_curve = plot.plot(pen=None, symbol="o", symbolSize=6, symbolPen=None, symbolBrush=self.anomalyCurveColor)
+        if not self.profiling:
+            plot.hide()
+        self.plots[node][sensor] = plot
+        self.curves[node][sensor] = curve
+        self.attack_curves[node][sensor] = attack_curve
+        self.band_curves[node][sensor] = band_curve
+        self.outlier_curves[node][sensor] = outlier_curve
+        if self.themed:
+            self.applyTheme(node, sensor)
+        # One column per sensor of the node, so that the plots stay in order whatever order they are created in
+        self.nodeGrids[node].addItem(plot, row=0, col=self.sensors[node].index(sensor))
+        return plot
+
+    def releasePlot(self, node: str, sensor: str) -> None:
+        """ Deletes a plot and the samples buffered for it """
+        self.nodeGrids[node].removeItem(self.plots[node].pop(sensor))
+        del self.curves[node][sensor]
+        del self.attack_curves[node][sensor]
+        del self.band_curves[node][sensor]
+        del self.outlier_curves[node][sensor]
+        self.plotHiddenSince.pop((node, sensor), None)
+        self.drawnState.pop((node, sensor), None)
+        self.drawnAttacks.pop((node, sensor), None)
+        self.anomalies.pop((node, sensor), None)
+        self.drawnAnomalies.pop((node, sensor), None)
+        self.store.remove(node, sensor)
+        self.plotReleased.emit(node, sensor)
+
+    def releaseNodeGrid(self, node: str) -> None:
+        for sensor in list(self.plots[node].keys()):
+            self.releasePlot(node, sensor)
+        grid: pg.GraphicsLayoutWidget = self.nodeGrids.pop(node)
+        self.windowLayout.removeWidget(grid)
+        grid.deleteLater()
+        del self.plots[node]
+        del self.curves[node]
+        del self.attack_curves[node]
+        del self.band_curves[node]
+        del self.outlier_curves[node]
+        self.nodeHiddenSince.pop(node, None)
+
+    def releaseHiddenPlots(self) -> None:
+        """ Releases the plots, and node grids, hidden for longer than plot_release_delay """
+        cutoff_ts: float = time.time() - cfg.plot_release_delay
+        for (node, sensor), hidden_ts in list(self.plotHiddenSince.items()):
+            if hidden_ts < cutoff_ts:
+                self.releasePlot(node, sensor)
+        for node, hidden_ts in list(self.nodeHiddenSince.items()):
+            if hidden_ts < cutoff_ts:
+                self.releaseNodeGrid(node)
 
     def drawPlots(self):
-        """ Queries the data from the database and draws all the visible plots """
+        """ Draws all the visible plots from the buffered data """
+        with stats.timed("render.frame"):
+            self.drawVisiblePlots()
+
+    def drawVisiblePlots(self):
         self.iter += 1
         if self.profiling and self.iter > self.maxiter:
             self.app.quit()
         visibleSensors: Dict[str, List[str]] = self.getVisibleSensors()
+        now: float = self.now()
+        cutoff_ts: float = now - self.buffer
+        self.store.drop_before(cutoff_ts)
         for node in visibleSensors.keys():
-            cutoff_ts: float = time.time() - self.buffer
-            data: Dict[str, List[Tuple[float, float]]] = dq.get_data_tuples_batch_after_ts(
-                node, visibleSensors[node], cutoff_ts)
-            attacks_data: List[Tuple(float, int)] = dq.get_node_attacks_after_ts(
-                node, cutoff_ts)
             for sensor in visibleSensors[node]:
-                if len(data[sensor]) != 0:
-                    # Plot the sensor data
-                    xOffset: float = data[sensor][0][0]
-                    xData: List[float] = [e[0] - xOffset for e in data[sensor]]
-                    yData: List[float] = [e[1] for e in data[sensor]]
-                    plot = self.plots[node][sensor]
-                    curve = self.curves[node][sensor]
-                    curve.setData(xData, yData)
-                    plot.setXRange(0, self.buffer)
-                    # Plot the attacks markers
-                    for i, attack_data in enumerate(attacks_data):
-                        try:
-                            attack_curve: pg.InfiniteLine = self.attack_curves[node][sensor][i]
-                        except IndexError:
-                            attack_curve = self.plots[node][sensor].addLine()
-                            attack_curve.setAngle(90)
-                            attack_curve.setPen(pg.mkPen(self.attackCurveColor, width=3))
-                            self.attack_curves[node][sensor].append(
-                                attack_curve)
-                        attack_curve.setValue((attack_data[0] - xOffset, 0))
-                    while len(self.attack_curves[node][sensor]) > len(attacks_data):
-                        # Prune unnecessary attack curves
-                        curve: pg.InfiniteLine = self.attack_curves[node][sensor].pop()
-                        self.plots[node][sensor].removeItem(curve)
+                buffer = self.store.get(node, sensor)
+                if len(buffer) == 0:
+                    continue
+                with stats.timed("render.setData"):
+                    self.updateCurve(node, sensor, buffer, cutoff_ts)
+                    # The samples keep their epoch timestamps, sliding the window only moves the view
+                    self.plots[node][sensor].setXRange(cutoff_ts, now, padding=0)
+                # Plot the attacks markers
+                self.drawAttacks(node, sensor, cutoff_ts)
+                if self.anomalyBands:
+                    self.drawAnomalies(node, sensor, buffer, cutoff_ts, now)
+
+    def updateCurve(self, node: str, sensor: str, buffer: RingBuffer, cutoff_ts: float) -> None:
+        """ Appends the samples received since the last frame to the curve.
+        The curve is only rebuilt when the window, the plot width or the buffered samples were reset """
+        curve: SegmentedCurve = self.curves[node][sensor]
+        layout: Tuple[int, int] = (self.buffer, self.resolution())
+        if self.drawnState.get((node, sensor)) != layout:
+            self.drawnState[(node, sensor)] = layout
+            curve.clear()
+            # No need to draw more than two points per pixel column
+            curve.bucketWidth = self.buffer / self.resolution()
+        curve.dropBefore(cutoff_ts)
+        new: int = int(np.searchsorted(buffer.timestamps, curve.lastTs, side="right"))
+        if new < len(buffer):
+            with stats.timed("render.transform"):
+                curve.append(buffer.timestamps[new:], buffer.values[new:])
+
+    def drawAttacks(self, node: str, sensor: str, cutoff_ts: float) -> None:
+        """ Draws one vertical segment per attack, spanning the data range, with a single item per plot """
+        with stats.timed("render.attacks"):
+            yRange: Tuple[float, float] = self.curves[node][sensor].yRange()
+            state: tuple = (self.attacksVersion.get(node, 0), yRange)
+            if self.drawnAttacks.get((node, sensor)) == state:
+                return
+            self.drawnAttacks[(node, sensor)] = state
+            attack_curve: pg.PlotDataItem = self.attack_curves[node][sensor]
+            xAttacks: np.ndarray = np.array([a[0] for a in self.attacks.get(node, []) if a[0] >= cutoff_ts], dtype=np.float64)
+            if len(xAttacks) == 0:
+                attack_curve.setData([], [])
+                return
+            yAttacks: np.ndarray = np.tile(yRange, len(xAttacks))
+            attack_curve.setData(np.repeat(xAttacks, 2), yAttacks, connect="pairs")
+
+    def drawAnomalies(self, node: str, sensor: str, buffer: RingBuffer, cutoff_ts: float, now: float) -> None:
+        """ Draws the mean ± k·σ band and highlights the samples received outside of it.
+        Only the samples received since the last frame are classified, the band itself is updated in O(1) """
+        with stats.timed("render.anomalies"):
+            tracker: AnomalyTracker = self.anomalies.get((node, sensor))
+            if tracker is None:
+                tracker = self.anomalies[(node, sensor)] = AnomalyTracker()
+            reference: Tuple[float, float] = None
+            if cfg.anomaly_reference == "sensor":
+                reference = dq.get_cached_sensor_baseline(node, sensor)
+                if reference is None:
+                    return
+            band: Tuple[float, float] = tracker.update(buffer, reference)
+            tracker.drop_before(cutoff_ts)
+            drawn: tuple = self.drawnAnomalies.get((node, sensor), (None, -1, float("-inf")))
+            band_curve: pg.PlotDataItem = self.band_curves[node][sensor]
+            # The band is drawn a window ahead of now, so that it only needs redrawing when it changes
+            if band != drawn[0] or (band is not None and now > drawn[2]):
+                if band is None:
+                    band_curve.setData([], [])
+                else:
+                    end_ts: float = now + self.buffer
+                    band_curve.setData([cutoff_ts, end_ts, cutoff_ts, end_ts], [band[0], band[0], band[1], band[1]],
+                                       connect="pairs")
+                    drawn = (band, drawn[1], end_ts)
+            if tracker.version != drawn[1]:
+                self.outlier_curves[node][sensor].setData(tracker.outliers.timestamps, tracker.outliers.values)
+            self.drawnAnomalies[(node, sensor)] = (band, tracker.version, drawn[2])
+
+    def setAnomalyBands(self, enabled: bool) -> None:
+        """ Shows or hides the anomaly bands. The outliers are tracked from scratch each time they are shown """
+        self.anomalyBands = enabled
+        # The rolling statistics are only kept while the bands are shown
+        self.store.set_track_stats(enabled and cfg.anomaly_reference == "rolling")
+        self.anomalies.clear()
+        self.drawnAnomalies.clear()
+        for node in self.plots.keys():
+            for sensor in self.plots[node].keys():
+                self.band_curves[node][sensor].setData([], [])
+                self.outlier_curves[node][sensor].setData([], [])
+        self.scheduler.markDirty()
+
+    def setBuffer(self, buffer: int) -> None:
+        """ Changes the duration of the plotted window. Widening it, or leaving a decimated window, drops the buffered data so the whole window gets fetched again """
+        if buffer > self.buffer or self.buffer > cfg.raw_window:
+            self.store.clear()
+            self.storeGeneration += 1
+            self.anomalies.clear()
+            self.drawnAnomalies.clear()
+        self.buffer = buffer
+        self.bufferChanged.emit(self.buffer, self.storeGeneration)
+        self.scheduler.markDirty()
 
     def getVisibleNodes(self) -> List[str]:
         """ Returns a list of all nodes that are currently visible """
-        visibleNodes: List[str] = []
-        for node in self.nodes:
-            if self.nodeGrids[node].isVisible():
-                visibleNodes.append(node)
-        return visibleNodes
+        return [node for node, grid in self.nodeGrids.items() if grid.isVisible()]
 
     def getVisibleSensors(self) -> Dict[str, List[str]]:
         visibleNodes: List[str] = self.getVisibleNodes()
         visibleSensors: Dict[str, List[str]] = {}
         for node in visibleNodes:
-            visibleSensors[node] = []
-            for sensor in self.sensors[node]:
-                if self.plots[node][sensor].isVisible():
-                    visibleSensors[node].append(sensor)
+            visibleSensors[node] = [sensor for sensor, plot in self.plots[node].items() if plot.isVisible()]
         return visibleSensors
 
+    def resolution(self) -> int:
+        """ Returns the number of pixel columns available to a plot """
+        return max(self.frameGeometry().width(), 1)
+
+    def hasVisibleSensors(self) -> bool:
+        return any(len(sensors) != 0 for sensors in self.getVisibleSensors().values())
+
+    def isPlotShown(self, node: str, sensor: str) -> bool:
+        return sensor in self.plots.get(node, {}) and self.plots[node][sensor].isVisible()
+
     def hideNode(self, node):
-        self.nodeGrids[node].hide()
+        if node in self.nodeGrids:
+            self.nodeGrids[node].hide()
+            self.nodeHiddenSince[node] = time.time()
         self.updateLayout()
 
     def showNode(self, node):
+        if node not in self.nodeGrids:
+            self.createNodeGrid(node)
         self.nodeGrids[node].show()
+        self.nodeHiddenSince.pop(node, None)
         self.updateLayout()
 
     def hidePlot(self, node: str, sensor: str):
-        self.plots[node][sensor].hide()
+        if sensor in self.plots.get(node, {}):
+            self.plots[node][sensor].hide()
+            self.plotHiddenSince[(node, sensor)] = time.time()
         self.updateLayout()
 
     def showPlot(self, node: str, sensor: str):
+        if sensor not in self.plots.get(node, {}):
+            self.createPlot(node, sensor)
         self.plots[node][sensor].show()
+        self.plotHiddenSince.pop((node, sensor), None)
         self.updateLayout()
 
     def updateLayout(self):
-        """ Workaround to force the plots to have a correct size. Resizes the main window to its current size, forcing the layout to be updated """
+        """ Workaround to force the plots to have a correct size. Resizes the main window to its current size, forcing the layout to be updated.
+        Also tells the fetch worker which sensors are now visible """
+        self.visibleSensorsChanged.emit(self.getVisibleSensors())
+        self.resolutionChanged.emit(self.resolution())
+        self.scheduler.markDirty()
         curr_width: int = self.frameGeometry().width()
         curr_height: int = self.frameGeometry().height()
         self.resize(curr_width, curr_height)
 
     def updateTheme(self, theme: str) -> None:
         """ Updates the background of all plots to the given color """
-        themeColors: Dict[str, str] = cfg.themes[theme]
-        for node in self.nodes:
-            self.nodeGrids[node].setBackground(themeColors["background"])
-            for sensor in self.sensors[node]:
-                self.plots[node][sensor].getAxis("bottom").setPen(themeColors["axis"])
-                self.plots[node][sensor].getAxis("left").setPen(themeColors["axis"])
-                self.plots[node][sensor].titleLabel.setText(node + "/" + sensor)
-                self.plots[node][sensor].titleLabel.setAttr("color", themeColors["text"])
-                self.curves[node][sensor].setPen(width=2, color=themeColors["data_curves"])
-                for attack_curve in self.attack_curves[node][sensor]:
-                    attack_curve.setPen(width=2, color=themeColors["attack_curves"])
-                self.curveColor = themeColors["data_curves"]
-                self.attackCurveColor = themeColors["attack_curves"]
+        self.theme = theme
+        self.themed = True
+        self.curveColor = cfg.themes[theme]["data_curves"]
+        self.attackCurveColor = cfg.themes[theme]["attack_curves"]
+        self.anomalyCurveColor = cfg.themes[theme]["anomaly_curves"]
+        for node in self.nodeGrids.keys():
+            self.nodeGrids[node].setBackground(cfg.themes[theme]["background"])
+            for sensor in self.plots[node].keys():
+                self.applyTheme(node, sensor)
+        self.scheduler.markDirty()
+
+    def applyTheme(self, node: str, sensor: str) -> None:
+        themeColors: Dict[str, str] = cfg.themes[self.theme]
+        self.plots[node][sensor].getAxis("bottom").setPen(themeColors["axis"])
+        self.plots[node][sensor].getAxis("left").setPen(themeColors["axis"])
+        self.plots[node][sensor].titleLabel.setText(node + "/" + sensor)
+        self.plots[node][sensor].titleLabel.setAttr("color", themeColors["text"])
+        self.curves[node][sensor].setPen(width=2, color=themeColors["data_curves"])
+        self.attack_curves[node][sensor].setPen(width=2, color=themeColors["attack_curves"])
+        self.band_curves[node][sensor].setPen(width=1, color=themeColors["anomaly_curves"], style=QtCore.Qt.DashLine)
+        self.outlier_curves[node][sensor].setSymbolBrush(themeColors["anomaly_curves"])
 
 
 class SettingsWindow(QtGui.QWidget):
@@ -197,7 +495,7 @@ class SettingsWindow(QtGui.QWidget):
         self.left: int = 800
         self.top: int = 800
         self.width: int = 300
-        self.height: int = 150
+        self.height: int = 400
         self.initUI()
         self.connections()
 
@@ -226,52 +524,105 @@ class SettingsWindow(QtGui.QWidget):
         themeLayout.addWidget(self.themeButton)
         layout.addLayout(themeLayout)
 
-        # Create a list of checkboxes of all the nodes and sensors
-        nodesLayout = QtWidgets.QVBoxLayout()
-        nodesLabeL = QtWidgets.QLabel("Nodes to plot: ")
-        nodesLayout.addWidget(nodesLabeL)
-        self.nodeButtons: Dict[str, QtWidgets.QCheckBox] = {}
-        self.sensorButtons: Dict[str, Dict[str, QtWidgets.QCheckBox]] = {}
-        for node in self.master.nodes:
-            # Create the node button
-            nodeButton = QtWidgets.QCheckBox(node)
-            nodeButton.setChecked(False)
-            nodesLayout.addWidget(nodeButton)
-            self.nodeButtons[node] = nodeButton
-            self.sensorButtons[node] = {}
-            # Create the node sensors buttons
-            sensorLayout = QtWidgets.QVBoxLayout()
-            sensorLayout.setContentsMargins(20, 0, 0, 0)  # Left padding
-            for i, sensor in enumerate(self.master.sensors[node]):
-                sensorButton = QtWidgets.QCheckBox(sensor)
-                sensorButton.setChecked(False)
-                sensorButton.hide()
-                sensorLayout.addWidget(sensorButton)
-                self.sensorButtons[node][sensor] = sensorButton
-            nodesLayout.addLayout(sensorLayout)
-        layout.addLayout(nodesLayout)
-
-        layout.addStretch()
+        # Create the anomaly bands button
+        self.anomalyButton = QtWidgets.QCheckBox("Show anomaly bands (mean ± %gσ)" % cfg.anomaly_k)
+        self.anomalyButton.setChecked(self.master.anomalyBands)
+        layout.addWidget(self.anomalyButton)
+
+        # Create the rendering statistics label
+        self.fpsLabel = QtWidgets.QLabel("Rendering: idle")
+        layout.addWidget(self.fpsLabel)
+
+        # Create the performance statistics panel
+        self.statsButton = QtWidgets.QCheckBox("Show performance statistics (ms, rows)")
+        self.statsButton.setChecked(False)
+        layout.addWidget(self.statsButton)
+        self.statsPanel = QtWidgets.QPlainTextEdit()
+        self.statsPanel.setReadOnly(True)
+        self.statsPanel.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.statsPanel.hide()
+        layout.addWidget(self.statsPanel)
+        self.statsTimer: QtCore.QTimer = QtCore.QTimer()
+        self.statsTimer.setInterval(1000)
+
+        # Create a tree of all the nodes and sensors, filtered by name. Only the visible rows are drawn
+        self.nodesLabel = QtWidgets.QLabel("Nodes to plot: (loading)")
+        layout.addWidget(self.nodesLabel)
+        self.filterInput: QtWidgets.QLineEdit = QtWidgets.QLineEdit()
+        self.filterInput.setPlaceholderText("Filter nodes and sensors")
+        self.filterInput.setClearButtonEnabled(True)
+        layout.addWidget(self.filterInput)
+        self.nodesModel: QtGui.QStandardItemModel = QtGui.QStandardItemModel()
+        self.nodesFilter: QtCore.QSortFilterProxyModel = QtCore.QSortFilterProxyModel()
+        self.nodesFilter.setSourceModel(self.nodesModel)
+        self.nodesFilter.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.nodesFilter.setRecursiveFilteringEnabled(True)
+        self.nodesTree: QtWidgets.QTreeView = QtWidgets.QTreeView()
+        self.nodesTree.setHeaderHidden(True)
+        self.nodesTree.setUniformRowHeights(True)
+        self.nodesTree.setModel(self.nodesFilter)
+        layout.addWidget(self.nodesTree, stretch=1)
+        if self.master.discovered:
+            self.populateNodes()
+
         self.setLayout(layout)
         self.show()
 
+    def populateNodes(self) -> None:
+        """ Fills the tree once the nodes and sensors are loaded """
+        self.nodesLabel.setText("Nodes to plot: ")
+        for node in self.master.nodes:
+            nodeItem = QtGui.QStandardItem(node)
+            nodeItem.setCheckable(True)
+            nodeItem.setEditable(False)
+            for sensor in self.master.sensors[node]:
+                # The sensors of a node can only be checked once the node is
+                sensorItem = QtGui.QStandardItem(sensor)
+                sensorItem.setCheckable(True)
+                sensorItem.setEditable(False)
+                sensorItem.setEnabled(False)
+                nodeItem.appendRow(sensorItem)
+            self.nodesModel.appendRow(nodeItem)
+
     def connections(self) -> None:
         """ Define the list of all button connections in the settings pane """
         # Buffer spinbox
         self.bufferInput.valueChanged.connect(self.bufferChanged)
         # Theme button
         self.themeButton.toggled.connect(self.themeChanged)
-        # Node and sensor checkboxes
-        for node in self.master.nodes:
-            self.nodeButtons[node].toggled.connect(self.nodeToggled)
-            for sensor in self.master.sensors[node]:
-                self.sensorButtons[node][sensor].toggled.connect(
-                    partial(self.sensorToggled, node, sensor))
+        # Anomaly bands button
+        self.anomalyButton.toggled.connect(self.master.setAnomalyBands)
+        # Rendering statistics
+        self.master.scheduler.statsUpdated.connect(self.renderStatsUpdated)
+        # Performance statistics panel
+        self.statsButton.toggled.connect(self.statsToggled)
+        self.statsTimer.timeout.connect(self.updateStatsPanel)
+        # Node and sensor tree
+        self.master.nodesLoaded.connect(self.populateNodes)
+        self.filterInput.textChanged.connect(self.nodesFilter.setFilterFixedString)
+        self.nodesModel.itemChanged.connect(self.itemToggled)
 
     def bufferChanged(self) -> None:
         """ When the buffer input is changed, updates the buffer value of the plotting window. Does not trigger an immediate re-plot """
         newBuffer: int = self.bufferInput.value()
-        self.master.buffer = newBuffer
+        self.master.setBuffer(newBuffer)
+
+    def renderStatsUpdated(self, fps: float, frameTime: float, frameBudget: float) -> None:
+        """ Displays the achieved FPS and frame time reported by the redraw scheduler """
+        self.fpsLabel.setText("Rendering: %.1f FPS, %.1f ms/frame (budget %.1f ms)" % (fps, frameTime, frameBudget))
+
+    def statsToggled(self) -> None:
+        """ Shows or hides the performance statistics panel, only refreshed while visible """
+        if self.statsButton.isChecked():
+            self.updateStatsPanel()
+            self.statsPanel.show()
+            self.statsTimer.start()
+        else:
+            self.statsTimer.stop()
+            self.statsPanel.hide()
+
+    def updateStatsPanel(self) -> None:
+        self.statsPanel.setPlainText(stats.format_text())
 
     def themeChanged(self) -> None:
         """ When the theme button is changed, swap the background color of the plots """
@@ -281,27 +632,30 @@ class SettingsWindow(QtGui.QWidget):
             theme = "light"
         self.master.updateTheme(theme)
 
-    def nodeToggled(self) -> None:
-        """ When a node checkbox is toggled, this function dynamically hides and shows the corresponding sensor checkboxes. It also unchecks sensors of unchecked nodes."""
-        for node in self.master.nodes:
-            if not self.nodeButtons[node].isChecked():
-                # Hide all the sensors buttons
-                self.master.hideNode(node)
-                for sensor in self.master.sensors[node]:
-                    self.sensorButtons[node][sensor].setChecked(False)
-                    self.sensorButtons[node][sensor].hide()
-            else:
-                # Show all the sensor buttons
+    def itemToggled(self, item: QtGui.QStandardItem) -> None:
+        """ Called when a node or sensor item changed. When a node is unchecked, its sensors are unchecked and disabled """
+        checked: bool = item.checkState() == QtCore.Qt.Checked
+        if item.parent() is None:
+            node: str = item.text()
+            if checked:
                 self.master.showNode(node)
-                for sensor in self.master.sensors[node]:
-                    self.sensorButtons[node][sensor].show()
-
-    def sensorToggled(self, node: str, sensor: str) -> None:
-        """ Called when a sensor checkbox is toggled """
-        if self.sensorButtons[node][sensor].isChecked():
-            self.master.showPlot(node, sensor)
+                self.nodesTree.expand(self.nodesFilter.mapFromSource(item.index()))
+            else:
+                self.master.hideNode(node)
+            for row in range(item.rowCount()):
+                sensorItem: QtGui.QStandardItem = item.child(row)
+                if not checked:
+                    sensorItem.setCheckState(QtCore.Qt.Unchecked)
+                sensorItem.setEnabled(checked)
         else:
-            self.master.hidePlot(node, sensor)
+            node = item.parent().text()
+            sensor: str = item.text()
+            if checked == self.master.isPlotShown(node, sensor):
+                return  # Not a check state change, e.g. the item was enabled
+            if checked:
+                self.master.showPlot(node, sensor)
+            else:
+                self.master.hidePlot(node, sensor)
 
 
 def main():
@@ -309,8 +663,8 @@ def main():
                         foreground=cfg.themes["light"]["axis"])
     app = pg.QtGui.QApplication(sys.argv)
     app.setApplicationName("Plotter")
-    session = create_sessions(cfg.db_path)
-    plots_win: PlotsWindow = PlotsWindow(session)
+    start_exporters()
+    plots_win: PlotsWindow = PlotsWindow()
     sett_win: SettingsWindow = SettingsWindow(plots_win)
     sys.exit(app.exec_())
 
@@ -318,8 +672,7 @@ def main():
 def profile(maxIter: int):
     app = pg.QtGui.QApplication(sys.argv)
     app.setApplicationName("Plotter - Profiling")
-    session = create_sessions(cfg.db_path)
-    plots_win = PlotsWindow(session, maxIter, True, app)
+    plots_win = PlotsWindow(maxIter, True, app)
     sett_win = SettingsWindow(plots_win)
     sys.exit(app.exec_())
 
@@ -0,0 +1,40 @@
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+def group_rows(rows: Iterable[Tuple[float, float, int]], keys: Iterable[int]) -> Dict[int, List[Tuple[float, float]]]:
+    """Groups timestamp/value/key rows by key in a single pass. The rows order is kept within each group"""
+    groups: Dict[int, List[Tuple[float, float]]] = {k: [] for k in keys}
+    for timestamp, value, key in rows:
+        if key in groups:
+            groups[key].append((timestamp, value))
+    return groups
+
+
+def split_sorted_columns(columns: np.ndarray, keys: Iterable[int]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Splits a (rows, 3) timestamp/value/key array sorted by key then timestamp into per-key
+    timestamp and value arrays, using the key boundaries rather than a scan per key"""
+    key_column: np.ndarray = columns[:, 2]
+    groups: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+    for key in keys:
+        start: int = int(np.searchsorted(key_column, key, side="left"))
+        end: int = int(np.searchsorted(key_column, key, side="right"))
+        groups[key] = (np.ascontiguousarray(columns[start:end, 0]),
+                       np.ascontiguousarray(columns[start:end, 1]))
+    return groups
+
+
+def minmax_decimate(timestamps: np.ndarray, values: np.ndarray, start_ts: float, end_ts: float, buckets: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduces the samples to at most two per time bucket, the minimum and the maximum, so that spikes are kept.
+    The samples are returned in time order. Nothing is done if there are already few enough samples"""
+    if len(timestamps) <= 2 * buckets or end_ts <= start_ts:
+        return timestamps, values
+    width: float = (end_ts - start_ts) / buckets
+    bucket: np.ndarray = np.clip(((timestamps - start_ts) // width).astype(np.int64), 0, buckets - 1)
+    order: np.ndarray = np.lexsort((values, bucket))  # By bucket, then by value
+    sorted_bucket: np.ndarray = bucket[order]
+    first: np.ndarray = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    last: np.ndarray = np.r_[first[1:] - 1, len(order) - 1]
+    picks: np.ndarray = np.unique(np.concatenate((order[first], order[last])))
+    return timestamps[picks], values[picks]
@@ -0,0 +1,145 @@
+# Plotter fed by a shared data server (data_server.py) instead of the database.
+# Run with: python data_client.py --host <server> --port <port>
+
+import argparse
+import sys
+from typing import List, Dict, Tuple
+
+import pyqtgraph as pg
+from PyQt5 import QtCore, QtNetwork
+
+import app
+import app_config as cfg
+from fetch_worker import FetchBatch
+from frames import encode_frame, decode_data, split_frames
+from instrumentation import stats
+
+
+class RemoteWorker(QtCore.QObject):
+    """ Stands in for the fetch worker. Subscribes to the visible sensors on the data server and hands the samples it streams to the GUI thread """
+    dataReady = QtCore.pyqtSignal(object)
+    nodesReceived = QtCore.pyqtSignal(object)
+
+    def __init__(self, _buffer: int, _host: str, _port: int):
+        super().__init__()
+        self.buffer: int = _buffer
+        self.host: str = _host
+        self.port: int = _port
+        self.generation: int = 0
+        self.visibleSensors: Dict[str, List[str]] = {}
+        self.received: bytearray = bytearray()
+        self.socket: QtNetwork.QTcpSocket = None
+        self.stopped: bool = False
+        self.reconnectPending: bool = False  # A failure is usually reported both as an error and a disconnection
+
+    @QtCore.pyqtSlot()
+    def start(self) -> None:
+        """ Connects to the server. Must be called from the worker thread """
+        self.socket = QtNetwork.QTcpSocket(self)
+        self.socket.connected.connect(self.subscribe)
+        self.socket.readyRead.connect(self.readFrames)
+        self.socket.disconnected.connect(self.reconnectLater)
+        self.socket.error.connect(self.connectionFailed)
+        self.connectToServer()
+
+    def connectToServer(self) -> None:
+        self.reconnectPending = False
+        self.received.clear()
+        self.socket.connectToHost(self.host, self.port)
+
+    def connectionFailed(self, error) -> None:
+        print("Data server %s:%d: %s" % (self.host, self.port, self.socket.errorString()), file=sys.stderr)
+        if self.socket.state() == QtNetwork.QAbstractSocket.UnconnectedState:
+            self.reconnectLater()
+
+    def reconnectLater(self) -> None:
+        if not self.stopped and not self.reconnectPending:
+            self.reconnectPending = True
+            QtCore.QTimer.singleShot(cfg.discovery_retry_interval, self.connectToServer)
+
+    @QtCore.pyqtSlot()
+    def stop(self) -> None:
+        self.stopped = True
+        if self.socket is not None:
+            self.socket.abort()
+
+    @QtCore.pyqtSlot(object)
+    def setVisibleSensors(self, visibleSensors: Dict[str, List[str]]) -> None:
+        self.visibleSensors = visibleSensors
+        self.subscribe()
+
+    @QtCore.pyqtSlot(str, str)
+    def releaseSensor(self, node: str, sensor: str) -> None:
+        pass  # The server sends the window again once the sensor is subscribed again
+
+    @QtCore.pyqtSlot(int)
+    def setResolution(self, buckets: int) -> None:
+        pass  # The server only streams raw samples
+
+    @QtCore.pyqtSlot(int, int)
+    def setBuffer(self, buffer: int, generation: int) -> None:
+        self.buffer = buffer
+        self.generation = generation
+        self.subscribe()
+
+    def subscribe(self) -> None:
+        """ Tells the server which sensors to stream. It sends the window of the new ones first """
+        if self.socket is None or self.socket.state() != QtNetwork.QAbstractSocket.ConnectedState:
+            return  # Subscribes once connected
+        sensors: Dict[str, List[str]] = {node: names for node, names in self.visibleSensors.items() if len(names) != 0}
+        self.socket.write(encode_frame({"type": "subscribe", "generation": self.generation,
+                                        "window": self.buffer, "sensors": sensors}))
+
+    def readFrames(self) -> None:
+        self.received += bytes(self.socket.readAll())
+        for header, body in split_frames(self.received):
+            if header["type"] == "nodes":
+                self.nodesReceived.emit(header["nodes"])
+            elif header["type"] == "data":
+                data: Dict[str, Dict[str, tuple]] = decode_data(header, body)
+                attacks: Dict[str, List[Tuple[float, int]]] = {
+                    node: [tuple(a) for a in node_attacks] for node, node_attacks in header["attacks"].items()}
+                stats.record("rows.remote", sum(len(d[0]) for n in data.values() for d in n.values()))
+                self.dataReady.emit(FetchBatch(header["generation"], data, attacks))
+
+
+class RemoteWindow(app.PlotsWindow):
+    """ Plots window fed by a data server. The window is limited to the one kept by the server """
+
+    def __init__(self, _host: str, _port: int):
+        self.host: str = _host
+        self.port: int = _port
+        super().__init__()
+        self.maxBuffer = cfg.server_window
+        self.setWindowTitle("Plots - %s:%d" % (_host, _port))
+
+    def createWorker(self) -> RemoteWorker:
+        worker: RemoteWorker = RemoteWorker(self.buffer, self.host, self.port)
+        # Connected before the worker starts, as the server sends the nodes as soon as it accepts the connection
+        worker.nodesReceived.connect(self.nodesDiscovered)
+        return worker
+
+    def startDiscovery(self) -> None:
+        pass  # The nodes are received from the server
+
+    def nodesDiscovered(self, sensors: Dict[str, List[str]]) -> None:
+        if not self.discovered:  # Sent again on each reconnection
+            super().nodesDiscovered(sensors)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Plots the measurements streamed by a data server")
+    parser.add_argument("--host", default=cfg.server_host)
+    parser.add_argument("--port", type=int, default=cfg.server_port)
+    args = parser.parse_args()
+    pg.setConfigOptions(background=cfg.themes["light"]["background"],
+                        foreground=cfg.themes["light"]["axis"])
+    qapp = pg.QtGui.QApplication(sys.argv)
+    qapp.setApplicationName("Plotter")
+    plots_win: RemoteWindow = RemoteWindow(args.host, args.port)
+    sett_win: app.SettingsWindow = app.SettingsWindow(plots_win)
+    sys.exit(qapp.exec_())
+
+
+if __name__ == "__main__":
+    main()
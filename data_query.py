@@ -1,29 +1,155 @@
+import time
 from typing import List, Tuple, Dict
 from operator import itemgetter
 
-from bookkeeper.sql import create_sessions, Node, Sensor, Measurement, Attack
+import numpy as np
+from sqlalchemy import select, func, Table
+
+from bookkeeper.sql import Node, Sensor, Measurement, Attack
 
 import app_config as cfg
+import db
+import hot_storage
+import rollup
+from columnar import group_rows, split_sorted_columns
+from instrumentation import stats
+
+session = db.session
+
+# Recurring per-tick queries, run as server-side prepared statements when supported
+_measurements = Measurement.__table__
+
+
+def _measurements_after_ts_sql(table_name: str) -> str:
+    return 'SELECT "%s", "%s", "%s" FROM "%s" WHERE "%s" = ANY($1::integer[]) AND "%s" >= $2 ORDER BY "%s", "%s"' % (
+        _measurements.c.timestamp.name, _measurements.c.value.name, _measurements.c.sensor_id.name, table_name,
+        _measurements.c.sensor_id.name, _measurements.c.timestamp.name,
+        _measurements.c.sensor_id.name, _measurements.c.timestamp.name)
+
+
+MEASUREMENTS_AFTER_TS_SQL: str = _measurements_after_ts_sql(_measurements.name)
+MEASUREMENTS_HOT_AFTER_TS_SQL: str = _measurements_after_ts_sql(hot_storage.hot_table.name)
+_attacks = Attack.__table__
+ATTACKS_AFTER_TS_SQL: str = \
+    'SELECT "%s", "%s", "%s" FROM "%s" WHERE "%s" = ANY($1::integer[]) AND "%s" >= $2 ORDER BY "%s"' % (
+        _attacks.c.timestamp.name, _attacks.c.attack_type.name, _attacks.c.node_id.name, _attacks.name,
+        _attacks.c.node_id.name, _attacks.c.timestamp.name, _attacks.c.timestamp.name)
+
+
+def metadata_query():
+    """Returns the query loading all the nodes and their sensors, with a single join"""
+    return select([Node.id, Node.name, Sensor.id, Sensor.name, Sensor.unit, Sensor.average, Sensor.std]).\
+        select_from(Node.__table__.outerjoin(Sensor.__table__, Sensor.node_id == Node.id))
+
+
+class MetadataCache:
+    """In-process cache of the nodes, sensors and units, loaded in bulk with a single join.
+    It is reloaded when older than the refresh interval, or on a lookup miss (at most once per miss interval)"""
+
+    def __init__(self, refresh_interval: float, miss_refresh_interval: float):
+        self.refresh_interval: float = refresh_interval
+        self.miss_refresh_interval: float = miss_refresh_interval
+        self.loaded_at: float = float("-inf")
+        self.node_ids: Dict[str, int] = {}
+        self.sensor_ids: Dict[Tuple[str, str], int] = {}
+        self.sensors: Dict[str, List[str]] = {}
+        self.units: Dict[int, str] = {}
+        self.node_names: Dict[int, str] = {}
+        self.sensor_names: Dict[int, Tuple[str, str]] = {}
+        self.baselines: Dict[int, Tuple[float, float]] = {}  # Expected average/std of each sensor
+
+    def refresh(self) -> None:
+        """Reloads all the nodes and sensors from the database"""
+        with stats.timed("query.metadata"):
+            rows: list = session.execute(metadata_query()).fetchall()
+        node_ids: Dict[str, int] = {}
+        sensor_ids: Dict[Tuple[str, str], int] = {}
+        sensors: Dict[str, List[str]] = {}
+        units: Dict[int, str] = {}
+        baselines: Dict[int, Tuple[float, float]] = {}
+        for node_id, node_name, sensor_id, sensor_name, unit, average, std in rows:
+            node_ids[node_name] = node_id
+            sensors.setdefault(node_name, [])
+            if sensor_id is not None:
+                sensor_ids[(node_name, sensor_name)] = sensor_id
+                sensors[node_name].append(sensor_name)
+                units[sensor_id] = unit
+                if average is not None and std is not None:
+                    baselines[sensor_id] = (average, std)
+        # Swap the dictionaries at once so that readers never see a partial state
+        self.node_ids, self.sensor_ids, self.sensors, self.units, self.baselines = \
+            node_ids, sensor_ids, sensors, units, baselines
+        self.node_names = {v: k for k, v in node_ids.items()}
+        self.sensor_names = {v: k for k, v in sensor_ids.items()}
+        self.loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """Forces a reload on the next lookup"""
+        self.loaded_at = float("-inf")
+
+    def ensure_fresh(self) -> None:
+        if time.monotonic() - self.loaded_at > self.refresh_interval:
+            self.refresh()
+
+    def refresh_on_miss(self) -> bool:
+        """Reloads the cache after a lookup miss, unless it was reloaded very recently. Returns True if it was reloaded"""
+        if time.monotonic() - self.loaded_at > self.miss_refresh_interval:
+            self.refresh()
+            return True
+        return False
+
+    def node_id(self, node_name: str) -> int:
+        self.ensure_fresh()
+        if node_name not in self.node_ids and not self.refresh_on_miss():
+            return 0
+        return self.node_ids.get(node_name, 0)
+
+    def sensor_id(self, node_name: str, sensor_name: str) -> int:
+        self.ensure_fresh()
+        if (node_name, sensor_name) not in self.sensor_ids and not self.refresh_on_miss():
+            return 0
+        return self.sensor_ids.get((node_name, sensor_name), 0)
 
-session = create_sessions(cfg.db_path)
+    def node_name(self, node_id: int) -> str:
+        """Returns the name of the given node ID, or None if it is unknown"""
+        self.ensure_fresh()
+        if node_id not in self.node_names:
+            self.refresh_on_miss()
+        return self.node_names.get(node_id)
+
+    def sensor_name(self, sensor_id: int) -> Tuple[str, str]:
+        """Returns the node/sensor names of the given sensor ID, or None if it is unknown"""
+        self.ensure_fresh()
+        if sensor_id not in self.sensor_names:
+            self.refresh_on_miss()
+        return self.sensor_names.get(sensor_id)
+
+    def all_nodes(self) -> List[str]:
+        self.ensure_fresh()
+        return list(self.node_ids.keys())
+
+    def all_sensors(self, node_name: str) -> List[str]:
+        self.ensure_fresh()
+        return list(self.sensors.get(node_name, []))
+
+    def unit(self, sensor_id: int) -> str:
+        self.ensure_fresh()
+        if sensor_id not in self.units:
+            self.refresh_on_miss()
+        return self.units[sensor_id]
+
+
+metadata = MetadataCache(cfg.metadata_refresh_interval, cfg.metadata_miss_refresh_interval)
 
 
 def get_node_id(name: str) -> int:
     """Given a node name, returns its ID"""
-    node = session.query(Node.id).filter_by(name=name).all()
-    if len(node) == 0:
-        return 0
-    return node[0].id
+    return metadata.node_id(name)
 
 
 def get_sensor_id(sensor_name: str, node_name: str) -> int:
     """Given a sensor/node name, returns its ID"""
-    node_id = session.query(Node.id).filter_by(name=node_name).all()
-    sensor = session.query(Sensor.id).filter_by(
-        name=sensor_name, node_id=node_id[0].id).all()
-    if len(sensor) == 0:
-        return 0
-    return sensor[0].id
+    return metadata.sensor_id(node_name, sensor_name)
 
 
 def get_data_tuples(node_name: str, sensor_name: str) -> List[Tuple[float, float]]:
@@ -55,46 +181,216 @@ def get_data_tuples_after_ts(node_name: str, sensor_name: str, cutoff_ts: float)
 def get_data_tuples_batch_after_ts(node_name: str, sensor_list: List[str], cutoff_ts: float) -> Dict[str, List[Tuple[float, float]]]:
     """Returns a list of list of tuples of all the sensors requested """
     node_id: int = get_node_id(node_name)
-    sensor_id_list: List[Tuple[str, int]] = [
-        (s, get_sensor_id(s, node_name)) for s in sensor_list]
+    sensor_ids: Dict[str, int] = {s: get_sensor_id(s, node_name) for s in sensor_list}
     values_blob: list = session.\
-        query(Measurement.value, Measurement.timestamp, Measurement.sensor_id).\
+        query(Measurement.timestamp, Measurement.value, Measurement.sensor_id).\
         filter_by(node_id=node_id).\
-        filter(Measurement.sensor_id.in_([s[1] for s in sensor_id_list])).\
+        filter(Measurement.sensor_id.in_(list(sensor_ids.values()))).\
         filter(Measurement.timestamp >= cutoff_ts).\
+        order_by(Measurement.sensor_id, Measurement.timestamp).\
         all()
-    values: Dict[str, List[Tuple[float, float]]] = {}
-    for sensor in sensor_id_list:
-        tmp_value: List[Tuple[float, float]] = []
-        for value in values_blob[::-1]:  # Go over the list backwards
-            if value.sensor_id == sensor[1]:
-                tmp_value.append((value.timestamp, value.value))
-        tmp_value.sort(key=itemgetter(0))
-        values[sensor[0]] = tmp_value
+    groups: Dict[int, List[Tuple[float, float]]] = group_rows(values_blob, sensor_ids.values())
+    values: Dict[str, List[Tuple[float, float]]] = {
+        sensor: groups[sensor_id] for sensor, sensor_id in sensor_ids.items()}
+    return values
+
+
+def fetch_columns(query, columns: int, name: str, prepared: Tuple[str, str, tuple] = None) -> np.ndarray:
+    """Runs the given SQLAlchemy core query and returns its rows as a float64 array of shape (rows, columns).
+    If given, the prepared statement name/SQL/parameters are run instead as a prepared statement when supported.
+    The query duration and row count are recorded under the given name"""
+    with stats.timed("query." + name):
+        if prepared is not None and db.use_prepared_statements():
+            rows: list = db.execute_prepared(*prepared)
+        else:
+            rows = session.execute(query).fetchall()
+    stats.record("rows." + name, len(rows))
+    return np.array(rows, dtype=np.float64).reshape(-1, columns)
+
+
+_hot_available: bool = False
+_hot_checked_at: float = float("-inf")
+_hot_bounds: Tuple[float, float] = (float("inf"), float("-inf"))
+_hot_loaded_at: float = float("-inf")
+
+
+def measurements_table(start_ts: float) -> Table:
+    """ Returns the hot table if it holds all the measurements after start_ts, the measurements table otherwise.
+    The bounds of the hot table only move forward, they are reloaded once it seems to end before now.
+    Whether the hot table exists is checked again every hot_check_interval, so that hot_storage.py can be installed
+    or removed while the plotter runs """
+    global _hot_available, _hot_checked_at, _hot_bounds, _hot_loaded_at
+    if time.monotonic() - _hot_checked_at > cfg.hot_check_interval:
+        _hot_available = hot_storage.supported(session.get_bind()) and hot_storage.tables_exist(session.get_bind())
+        _hot_checked_at = time.monotonic()
+        if not _hot_available:
+            _hot_bounds = (float("inf"), float("-inf"))  # Reloaded if it is installed again
+    if not _hot_available:
+        return _measurements
+    now: float = time.time()
+    if _hot_bounds[1] <= now and time.monotonic() - _hot_loaded_at > cfg.hot_state_refresh_interval:
+        _hot_bounds = hot_storage.get_state(session)
+        _hot_loaded_at = time.monotonic()
+    # Partitions are dropped after hot_retention, the cached start bound may be older
+    if max(_hot_bounds[0], now - cfg.hot_retention) <= start_ts and now < _hot_bounds[1]:
+        return hot_storage.hot_table
+    return _measurements
+
+
+def get_data_arrays_batch_after_ts(node_name: str, sensor_list: List[str], cutoff_ts: float) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Returns the timestamps and values arrays of all the sensors requested, sorted by timestamp"""
+    node_id: int = get_node_id(node_name)
+    sensor_ids: Dict[str, int] = {s: get_sensor_id(s, node_name) for s in sensor_list}
+    table: Table = measurements_table(cutoff_ts)
+    query = select([table.c.timestamp, table.c.value, table.c.sensor_id]).\
+        where(table.c.node_id == node_id).\
+        where(table.c.sensor_id.in_(list(sensor_ids.values()))).\
+        where(table.c.timestamp >= cutoff_ts).\
+        order_by(table.c.sensor_id, table.c.timestamp)
+    columns: np.ndarray = fetch_columns(query, 3, "measurements")
+    groups: Dict[int, Tuple[np.ndarray, np.ndarray]] = split_sorted_columns(columns, sensor_ids.values())
+    values: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+        sensor: groups[sensor_id] for sensor, sensor_id in sensor_ids.items()}
     return values
 
 
 def get_data_tuples_batch_after_ts_all_nodes(nodes_list: List[str], sensor_dict: Dict[str, List[str]], cutoff_ts: float) -> Dict[str, Dict[str, List[Tuple[float, float]]]]:
     """ Returns all the values for all the given nodes/sensors after the given cutoff timestamp """
-    # node_ids: List[int] = [get_node_id(e) for e in nodes_list]
-    sensor_ids: Dict[str, int] = {n + s: get_sensor_id(
+    sensor_ids: Dict[Tuple[str, str], int] = {(n, s): get_sensor_id(
         s, n) for n in nodes_list for s in sensor_dict[n]}
-    sensor_ids_list: List[int] = [e for e in sensor_ids.values()]
     values_blob: list = session.\
-        query(Measurement.value, Measurement.timestamp, Measurement.sensor_id).\
-        filter(Measurement.sensor_id.in_(sensor_ids_list)).\
+        query(Measurement.timestamp, Measurement.value, Measurement.sensor_id).\
+        filter(Measurement.sensor_id.in_(list(sensor_ids.values()))).\
         filter(Measurement.timestamp >= cutoff_ts).\
+        order_by(Measurement.sensor_id, Measurement.timestamp).\
         all()
-    values: Dict[str, Dict[str, List[Tuple[float, float]]]] = {}
-    for node in nodes_list:
-        values[node] = {}
-        for sensor in sensor_dict[node]:
-            tmp_value: List[Tuple[float, float]] = []
-            for value in values_blob:
-                if value.sensor_id == sensor_ids[node + sensor]:
-                    tmp_value.append((value.timestamp, value.value))
-            tmp_value.sort(key=itemgetter(0))
-            values[node][sensor] = tmp_value
+    groups: Dict[int, List[Tuple[float, float]]] = group_rows(values_blob, sensor_ids.values())
+    values: Dict[str, Dict[str, List[Tuple[float, float]]]] = {node: {} for node in nodes_list}
+    for (node, sensor), sensor_id in sensor_ids.items():
+        values[node][sensor] = groups[sensor_id]
+    return values
+
+
+def measurements_after_ts_query(table: Table, sensor_ids: List[int], cutoff_ts: float):
+    """ Returns the query of the rows of the given sensors after the cutoff timestamp, sorted by sensor and timestamp.
+    Also run as the MEASUREMENTS_AFTER_TS_SQL prepared statements """
+    return select([table.c.timestamp, table.c.value, table.c.sensor_id]).\
+        where(table.c.sensor_id.in_(sensor_ids)).\
+        where(table.c.timestamp >= cutoff_ts).\
+        order_by(table.c.sensor_id, table.c.timestamp)
+
+
+def measurements_between_ts_query(table: Table, sensor_ids: List[int], start_ts: float, end_ts: float):
+    """ Returns the query of the rows of the given sensors in [start_ts, end_ts), sorted by sensor and timestamp """
+    return select([table.c.timestamp, table.c.value, table.c.sensor_id]).\
+        where(table.c.sensor_id.in_(sensor_ids)).\
+        where(table.c.timestamp >= start_ts).\
+        where(table.c.timestamp < end_ts).\
+        order_by(table.c.sensor_id, table.c.timestamp)
+
+
+def get_data_arrays_batch_after_ts_all_nodes(nodes_list: List[str], sensor_dict: Dict[str, List[str]], cutoff_ts: float) -> Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """ Returns the timestamps and values arrays of all the given nodes/sensors after the given cutoff timestamp, in a single query """
+    sensor_ids: Dict[Tuple[str, str], int] = {(n, s): get_sensor_id(
+        s, n) for n in nodes_list for s in sensor_dict[n]}
+    table: Table = measurements_table(cutoff_ts)
+    query = measurements_after_ts_query(table, list(sensor_ids.values()), cutoff_ts)
+    if table is hot_storage.hot_table:
+        prepared: Tuple[str, str, tuple] = ("plotter_measurements_hot", MEASUREMENTS_HOT_AFTER_TS_SQL,
+                                            (list(sensor_ids.values()), cutoff_ts))
+    else:
+        prepared = ("plotter_measurements", MEASUREMENTS_AFTER_TS_SQL, (list(sensor_ids.values()), cutoff_ts))
+    columns: np.ndarray = fetch_columns(query, 3, "measurements", prepared)
+    groups: Dict[int, Tuple[np.ndarray, np.ndarray]] = split_sorted_columns(columns, sensor_ids.values())
+    values: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {node: {} for node in nodes_list}
+    for (node, sensor), sensor_id in sensor_ids.items():
+        values[node][sensor] = groups[sensor_id]
+    return values
+
+
+def get_data_arrays_between_ts_all_nodes(nodes_list: List[str], sensor_dict: Dict[str, List[str]], start_ts: float, end_ts: float) -> Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """ Returns the timestamps and values arrays of all the given nodes/sensors in [start_ts, end_ts), in a single query """
+    sensor_ids: Dict[Tuple[str, str], int] = {(n, s): get_sensor_id(
+        s, n) for n in nodes_list for s in sensor_dict[n]}
+    query = measurements_between_ts_query(measurements_table(start_ts), list(sensor_ids.values()), start_ts, end_ts)
+    columns: np.ndarray = fetch_columns(query, 3, "measurements_range")
+    groups: Dict[int, Tuple[np.ndarray, np.ndarray]] = split_sorted_columns(columns, sensor_ids.values())
+    values: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {node: {} for node in nodes_list}
+    for (node, sensor), sensor_id in sensor_ids.items():
+        values[node][sensor] = groups[sensor_id]
+    return values
+
+
+def aggregate_buckets(sensor_ids: List[int], start_ts: float, end_ts: float, grid_ts: float, width: float, resolution: int = 0) -> np.ndarray:
+    """ Returns the sensor_id/bucket/min/max rows between the given timestamps, sorted by sensor and bucket.
+    Bucket n spans [grid_ts + n * width, grid_ts + (n + 1) * width). Aggregates the raw measurements, or the rollups
+    of the given resolution if it is not 0 """
+    table: Table = measurements_table(start_ts) if resolution == 0 else rollup.rollup_tables[resolution]
+    query = aggregate_buckets_query(table, sensor_ids, start_ts, end_ts, grid_ts, width)
+    return fetch_columns(query, 4, "rollup" if resolution != 0 else "decimated")
+
+
+def aggregate_buckets_query(table: Table, sensor_ids: List[int], start_ts: float, end_ts: float, grid_ts: float, width: float):
+    """ Returns the query of the sensor_id/bucket/min/max rows of aggregate_buckets, from a measurements or a rollup table """
+    if table in rollup.rollup_tables.values():
+        sensor_col, ts_col, min_col, max_col = table.c.sensor_id, table.c.bucket, table.c.min, table.c.max
+    else:
+        sensor_col, ts_col, min_col, max_col = table.c.sensor_id, table.c.timestamp, table.c.value, table.c.value
+    bucket = rollup.floor_expr((ts_col - grid_ts) / width, session.get_bind().dialect.name).label("bucket")
+    return select([sensor_col, bucket, func.min(min_col), func.max(max_col)]).\
+        where(sensor_col.in_(sensor_ids)).\
+        where(ts_col >= start_ts).\
+        where(ts_col < end_ts).\
+        group_by(sensor_col, bucket).\
+        order_by(sensor_col, bucket)
+
+
+_rollups_available: bool = False
+_rollups_checked_at: float = float("-inf")
+
+
+def rollups_available() -> bool:
+    """ Checks whether the rollup tables were created. Checked again every rollup_check_interval until they are,
+    so that rollup.py can be started after the plotter """
+    global _rollups_available, _rollups_checked_at
+    if not _rollups_available and cfg.use_rollups and \
+            time.monotonic() - _rollups_checked_at > cfg.rollup_check_interval:
+        _rollups_available = rollup.tables_exist(session.get_bind())
+        _rollups_checked_at = time.monotonic()
+    return _rollups_available
+
+
+def get_data_arrays_decimated_all_nodes(nodes_list: List[str], sensor_dict: Dict[str, List[str]], start_ts: float, end_ts: float, buckets: int) -> Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """ Returns at most two points per time bucket (the minimum and maximum values) for all the given nodes/sensors between the given timestamps.
+    The aggregation is done by the database, so that the raw rows are never transferred. The coarsest rollup resolution
+    that still gives enough points is used for the part of the window already rolled up, the raw measurements for the rest """
+    sensor_ids: Dict[Tuple[str, str], int] = {(n, s): get_sensor_id(
+        s, n) for n in nodes_list for s in sensor_dict[n]}
+    ids: List[int] = list(sensor_ids.values())
+    width: float = (end_ts - start_ts) / buckets
+    raw_start: float = start_ts
+    rows_list: List[np.ndarray] = []
+    if rollups_available():
+        watermarks: Dict[int, float] = rollup.get_watermarks(session)
+        resolution: int = rollup.choose_resolution(end_ts - start_ts, buckets, watermarks)
+        if resolution != 0 and watermarks[resolution] > start_ts:
+            raw_start = min(watermarks[resolution], end_ts)
+            rows_list.append(aggregate_buckets(ids, start_ts, raw_start, start_ts, width, resolution))
+    if raw_start < end_ts:
+        rows_list.append(aggregate_buckets(ids, raw_start, end_ts, start_ts, width, 0))
+    rows: np.ndarray = np.concatenate(rows_list)
+    if len(rows_list) > 1:
+        rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+    # Draw each bucket as a vertical segment from its minimum to its maximum, at the bucket center
+    columns: np.ndarray = np.empty((2 * len(rows), 3), dtype=np.float64)
+    columns[:, 0] = np.repeat(start_ts + (rows[:, 1] + 0.5) * width, 2)
+    columns[0::2, 1] = rows[:, 2]
+    columns[1::2, 1] = rows[:, 3]
+    columns[:, 2] = np.repeat(rows[:, 0], 2)
+    groups: Dict[int, Tuple[np.ndarray, np.ndarray]] = split_sorted_columns(columns, sensor_ids.values())
+    values: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {node: {} for node in nodes_list}
+    for (node, sensor), sensor_id in sensor_ids.items():
+        values[node][sensor] = groups[sensor_id]
     return values
 
 
@@ -102,26 +398,31 @@ def get_data_tuples_batch(node_name: str, sensor_list: List[str]) -> Dict[str, L
     return get_data_tuples_batch_after_ts(node_name, sensor_list, 0)
 
 
+def get_nodes_and_sensors() -> Dict[str, List[str]]:
+    """Returns the sensors of every node, all discovered with a single query """
+    metadata.refresh()
+    return {node: list(sensors) for node, sensors in metadata.sensors.items()}
+
+
 def get_all_sensors(node_name: str) -> List[str]:
     """Returns the list of all sensors for the given node in the database """
-    node_id: int = get_node_id(node_name)
-    sensors: list = session.query(Sensor.name).filter_by(node_id=node_id).all()
-    sensors_str: List[str] = [e.name for e in sensors]
-    return sensors_str
+    return metadata.all_sensors(node_name)
 
 
 def get_all_nodes() -> List[str]:
     """Returns the list of all nodes names stored in the database """
-    nodes: list = session.query(Node.name).all()
-    nodes_str: List[str] = [e.name for e in nodes]
-    return nodes_str
+    return metadata.all_nodes()
+
+
+def get_cached_sensor_baseline(node_name: str, sensor_name: str) -> Tuple[float, float]:
+    """Returns the expected average/std of the sensor as last loaded, or None if unknown. Never queries the database """
+    sensor_id: int = metadata.sensor_ids.get((node_name, sensor_name))
+    return metadata.baselines.get(sensor_id)
 
 
 def get_sensor_unit(node_name: str, sensor_name: str) -> str:
     """Returns the unit of the sensor"""
-    sensor_id = get_sensor_id(sensor_name, node_name)
-    sensor = session.query(Sensor.unit).filter_by(id=sensor_id).all()
-    return sensor[0].unit
+    return metadata.unit(get_sensor_id(sensor_name, node_name))
 
 
 def get_node_attacks(node_name: str) -> List[Tuple[float, int]]:
@@ -136,10 +437,52 @@ def get_node_attacks(node_name: str) -> List[Tuple[float, int]]:
 
 def get_node_attacks_after_ts(node_name: str, cutoff_ts: float) -> List[Tuple[float, int]]:
     """Returns a list of tuples of timestamp/attack_type of attacks after the given timestamp """
-    attacks_all: List[Tuple[float, int]] = get_node_attacks(node_name)
-    attacks_cutoff: List[Tuple[float, int]] = [
-        a for a in attacks_all if a[0] >= cutoff_ts]
-    return attacks_cutoff
+    return get_attacks_after_ts_all_nodes([node_name], cutoff_ts)[node_name]
+
+
+def attacks_after_ts_query(node_ids: List[int], cutoff_ts: float):
+    """Returns the query of the attacks of the given nodes after the cutoff timestamp. Also run as the ATTACKS_AFTER_TS_SQL prepared statement """
+    return select([Attack.timestamp, Attack.attack_type, Attack.node_id]).\
+        where(Attack.node_id.in_(node_ids)).\
+        where(Attack.timestamp >= cutoff_ts).\
+        order_by(Attack.timestamp)
+
+
+def attacks_between_ts_query(node_ids: List[int], start_ts: float, end_ts: float):
+    """Returns the query of the attacks of the given nodes in [start_ts, end_ts) """
+    return select([Attack.timestamp, Attack.attack_type, Attack.node_id]).\
+        where(Attack.node_id.in_(node_ids)).\
+        where(Attack.timestamp >= start_ts).\
+        where(Attack.timestamp < end_ts).\
+        order_by(Attack.timestamp)
+
+
+def get_attacks_after_ts_all_nodes(nodes_list: List[str], cutoff_ts: float) -> Dict[str, List[Tuple[float, int]]]:
+    """Returns the timestamp/attack_type tuples of the attacks of all the given nodes after the given timestamp, in a single query """
+    node_names: Dict[int, str] = {get_node_id(n): n for n in nodes_list}
+    with stats.timed("query.attacks"):
+        if db.use_prepared_statements():
+            attacks: list = db.execute_prepared("plotter_attacks", ATTACKS_AFTER_TS_SQL,
+                                                (list(node_names.keys()), cutoff_ts))
+        else:
+            attacks = session.execute(attacks_after_ts_query(list(node_names.keys()), cutoff_ts)).fetchall()
+    stats.record("rows.attacks", len(attacks))
+    attacks_dict: Dict[str, List[Tuple[float, int]]] = {node: [] for node in nodes_list}
+    for timestamp, attack_type, node_id in attacks:
+        attacks_dict[node_names[node_id]].append((timestamp, attack_type))
+    return attacks_dict
+
+
+def get_attacks_between_ts_all_nodes(nodes_list: List[str], start_ts: float, end_ts: float) -> Dict[str, List[Tuple[float, int]]]:
+    """Returns the timestamp/attack_type tuples of the attacks of all the given nodes in [start_ts, end_ts), in a single query """
+    node_names: Dict[int, str] = {get_node_id(n): n for n in nodes_list}
+    with stats.timed("query.attacks_range"):
+        attacks: list = session.execute(attacks_between_ts_query(list(node_names.keys()), start_ts, end_ts)).fetchall()
+    stats.record("rows.attacks_range", len(attacks))
+    attacks_dict: Dict[str, List[Tuple[float, int]]] = {node: [] for node in nodes_list}
+    for timestamp, attack_type, node_id in attacks:
+        attacks_dict[node_names[node_id]].append((timestamp, attack_type))
+    return attacks_dict
 
 
 def remove_useless_sensors(all_sensors: List[str]) -> List[str]:
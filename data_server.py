@@ -0,0 +1,225 @@
+# Shared data server: polls the database once for all the connected plotters, keeps the recent window in memory
+# and streams the new samples of the sensors each plotter displays. The database load does not depend on the number of viewers.
+# Run with: python data_server.py, then python data_client.py on each viewer
+
+import argparse
+import queue
+import socket
+import sys
+import threading
+import time
+from typing import List, Dict, Set, Tuple
+
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+
+import app_config as cfg
+import data_query as dq
+from frames import encode_frame, encode_data, read_frame
+from timeseries import TimeSeriesStore
+
+
+class Client:
+    """ A connected plotter, the sensors it displays, and its queue of frames to send """
+
+    def __init__(self, sock: socket.socket, address: Tuple[str, int]):
+        self.sock: socket.socket = sock
+        self.address: Tuple[str, int] = address
+        self.frames: queue.Queue = queue.Queue(maxsize=cfg.server_client_queue)
+        self.sensors: Dict[str, Set[str]] = {}
+        self.window: float = 0.
+        self.generation: int = 0  # Echoed in the data frames, so that the plotter can drop the ones sent before it reset its buffers
+        self.attacks: Dict[str, List[Tuple[float, int]]] = {}  # Attacks last sent for each node
+
+    def send(self, frame: bytes) -> bool:
+        """ Queues a frame. Returns False if the client does not keep up """
+        try:
+            self.frames.put_nowait(frame)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Already disconnected
+
+
+class DataServer:
+    """ Polls the sensors displayed by any client and fans the new samples out to the clients displaying them """
+
+    def __init__(self, host: str, port: int, window: float = cfg.server_window, interval: float = cfg.fetch_interval / 1000.):
+        self.window: float = window
+        self.interval: float = interval
+        self.store: TimeSeriesStore = TimeSeriesStore(int(window * cfg.max_sample_rate))
+        self.attacks: Dict[str, List[Tuple[float, int]]] = {}
+        self.clients: List[Client] = []
+        self.lock: threading.Lock = threading.Lock()
+        self.server: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+
+    def serve_forever(self) -> None:
+        self.refresh_metadata()  # Before the first clients get the tree
+        threading.Thread(target=self.accept, daemon=True).start()
+        while True:
+            start: float = time.monotonic()
+            self.poll()
+            time.sleep(max(self.interval - (time.monotonic() - start), 0.))
+
+    def accept(self) -> None:
+        while True:
+            sock, address = self.server.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client: Client = Client(sock, address)
+            threading.Thread(target=self.read_client, args=(client,), daemon=True).start()
+            threading.Thread(target=self.write_client, args=(client,), daemon=True).start()
+
+    def read_client(self, client: Client) -> None:
+        """ Sends the nodes and sensors to a new client, then applies its subscriptions until it disconnects.
+        The tree is the one cached by the poll thread, so that connections do not query the database """
+        try:
+            nodes: Dict[str, List[str]] = {node: list(sensors) for node, sensors in dq.metadata.sensors.items()}
+            client.send(encode_frame({"type": "nodes", "nodes": nodes}))
+            with self.lock:
+                self.clients.append(client)
+            print("%s:%d connected" % client.address, file=sys.stderr)
+            while True:
+                header, _ = read_frame(client.sock)
+                if header is None:
+                    break
+                if header["type"] == "subscribe":
+                    self.subscribe(client, header)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Disconnected, or sent a malformed frame
+            print("%s:%d failed: %s" % (client.address + (e,)), file=sys.stderr)
+        finally:
+            self.disconnect(client)
+
+    def write_client(self, client: Client) -> None:
+        try:
+            while True:
+                frame: bytes = client.frames.get()
+                if frame is None:
+                    break
+                client.sock.sendall(frame)
+        except OSError:
+            self.disconnect(client)
+
+    def disconnect(self, client: Client) -> None:
+        with self.lock:
+            if client not in self.clients:
+                return
+            self.clients.remove(client)
+        client.close()
+        try:
+            client.frames.put_nowait(None)  # Stops the writer
+        except queue.Full:
+            pass  # The writer stops on the closed socket
+        print("%s:%d disconnected" % client.address, file=sys.stderr)
+
+    def subscribe(self, client: Client, header: dict) -> None:
+        """ Changes the sensors sent to a client, and sends it the buffered window of the sensors it did not have yet """
+        sensors: Dict[str, Set[str]] = {node: set(names) for node, names in header["sensors"].items()}
+        with self.lock:
+            if header["generation"] != client.generation:
+                # The client dropped its buffers, send it the whole window again
+                client.sensors = {}
+                client.attacks = {}
+            added: Dict[str, List[str]] = {node: [s for s in names if s not in client.sensors.get(node, set())]
+                                           for node, names in sensors.items()}
+            client.sensors = sensors
+            client.window = min(float(header["window"]), self.window)
+            client.generation = header["generation"]
+            cutoff_ts: float = time.time() - client.window
+            backlog: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+            for node, names in added.items():
+                for sensor in names:
+                    buffer = self.store.buffers.get((node, sensor))
+                    if buffer is None:
+                        continue  # Not polled yet, the next poll sends it
+                    first: int = int(np.searchsorted(buffer.timestamps, cutoff_ts, side="left"))
+                    backlog.setdefault(node, {})[sensor] = (buffer.timestamps[first:], buffer.values[first:])
+            self.send_update(client, backlog)
+
+    def poll(self) -> None:
+        """ Fetches the new samples of all the sensors displayed by any client, in a single query, and sends them """
+        self.refresh_metadata()
+        with self.lock:
+            subscribed: Dict[str, Set[str]] = {}
+            for client in self.clients:
+                for node, names in client.sensors.items():
+                    subscribed.setdefault(node, set()).update(names)
+        nodes: List[str] = [node for node in subscribed.keys() if len(subscribed[node]) != 0]
+        if len(nodes) == 0:
+            return
+        sensors: Dict[str, List[str]] = {node: sorted(subscribed[node]) for node in nodes}
+        cutoff_ts: float = time.time() - self.window
+        fetch_ts: float = min(max(self.store.last_ts(node, sensor), cutoff_ts) for node in nodes for sensor in sensors[node])
+        try:
+            data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = dq.get_data_arrays_batch_after_ts_all_nodes(nodes, sensors, fetch_ts)
+            attacks: Dict[str, List[Tuple[float, int]]] = dq.get_attacks_after_ts_all_nodes(nodes, cutoff_ts)
+        except SQLAlchemyError as e:
+            print("Fetch failed: %s" % e, file=sys.stderr)
+            dq.session.rollback()
+            return
+        finally:
+            dq.session.close()
+        with self.lock:
+            new: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+            for node in data.keys():
+                for sensor, (timestamps, values) in data[node].items():
+                    first: int = int(np.searchsorted(timestamps, self.store.last_ts(node, sensor), side="right"))
+                    if first < len(timestamps):
+                        self.store.append(node, sensor, timestamps[first:], values[first:])
+                        new.setdefault(node, {})[sensor] = (timestamps[first:], values[first:])
+            self.attacks.update(attacks)
+            self.store.drop_before(cutoff_ts)
+            for client in list(self.clients):
+                self.send_update(client, new)
+
+    def refresh_metadata(self) -> None:
+        """ Reloads the nodes and sensors sent to the new clients, once they are older than the refresh interval """
+        try:
+            dq.metadata.ensure_fresh()
+        except SQLAlchemyError as e:
+            print("Loading the nodes failed: %s" % e, file=sys.stderr)
+            dq.session.rollback()
+        finally:
+            dq.session.close()
+
+    def send_update(self, client: Client, data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]) -> None:
+        """ Sends the given samples of the sensors displayed by the client, and the attacks that changed in its window.
+        Disconnects the clients that do not keep up. Must be called with the lock held """
+        client_data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {
+            node: {s: v for s, v in data[node].items() if s in client.sensors.get(node, set())} for node in data.keys()}
+        client_data = {node: sensors for node, sensors in client_data.items() if len(sensors) != 0}
+        cutoff_ts: float = time.time() - client.window
+        attacks: Dict[str, List[Tuple[float, int]]] = {}
+        for node in client.sensors.keys():
+            node_attacks: List[Tuple[float, int]] = [tuple(a) for a in self.attacks.get(node, []) if a[0] >= cutoff_ts]
+            if node_attacks != client.attacks.get(node):
+                attacks[node] = node_attacks
+        if len(client_data) == 0 and len(attacks) == 0:
+            return
+        client.attacks.update(attacks)
+        frame: bytes = encode_data({"type": "data", "generation": client.generation, "attacks": attacks}, client_data)
+        if not client.send(frame):
+            print("%s:%d does not keep up, disconnecting it" % client.address, file=sys.stderr)
+            threading.Thread(target=self.disconnect, args=(client,), daemon=True).start()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serves the recent measurements to several plotters")
+    parser.add_argument("--host", default=cfg.server_host)
+    parser.add_argument("--port", type=int, default=cfg.server_port)
+    args = parser.parse_args()
+    server: DataServer = DataServer(args.host, args.port)
+    print("Serving on %s:%d" % (args.host, args.port), file=sys.stderr)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
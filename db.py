@@ -0,0 +1,43 @@
+from typing import Sequence, Set
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+import app_config as cfg
+
+
+def make_engine(db_path: str) -> Engine:
+    """Creates a pooled engine. Connections are checked before use, so dropped ones are replaced transparently"""
+    if db_path.startswith("sqlite"):
+        return create_engine(db_path)  # SQLite does not use a connection pool
+    return create_engine(db_path,
+                         pool_size=cfg.db_pool_size,
+                         max_overflow=cfg.db_max_overflow,
+                         pool_recycle=cfg.db_pool_recycle,
+                         pool_pre_ping=True)
+
+
+engine: Engine = make_engine(cfg.db_path)
+# One session per thread, e.g. the GUI thread and the fetch worker
+session = scoped_session(sessionmaker(bind=engine))
+
+
+def use_prepared_statements() -> bool:
+    return cfg.db_prepared_statements and engine.dialect.name == "postgresql"
+
+
+def execute_prepared(name: str, sql: str, params: Sequence) -> list:
+    """Runs a recurring query as a server-side prepared statement, prepared once per pooled connection.
+    The SQL uses $1, $2... placeholders. PostgreSQL only"""
+    dbapi_connection = session.connection().connection
+    prepared: Set[str] = dbapi_connection.info.setdefault("prepared_statements", set())
+    cursor = dbapi_connection.cursor()
+    try:
+        if name not in prepared:
+            cursor.execute("PREPARE %s AS %s" % (name, sql))
+            prepared.add(name)
+        cursor.execute("EXECUTE %s (%s)" % (name, ", ".join(["%s"] * len(params))), params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
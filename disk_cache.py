@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+import app_config as cfg
+
+
+class PendingChunk:
+    """ Samples of a chunk not closed yet, accumulated from consecutive fetches """
+
+    def __init__(self, index: int):
+        self.index: int = index
+        self.timestamps: List[np.ndarray] = []
+        self.values: List[np.ndarray] = []
+        self.covered_ts: float = float("-inf")  # All the samples up to this timestamp (included) were added
+
+
+class ChunkCache:
+    """ Local cache of the measurements, one memory-mapped .npy file of timestamps/values per sensor and time chunk.
+    Only closed chunks are written, so cached chunks never change. The least recently used files are evicted above max_size """
+
+    def __init__(self, directory: str, db_path: str, chunk: float = cfg.cache_chunk, max_size: int = cfg.cache_max_size):
+        # One directory per database, without the credentials in the path
+        self.directory: str = os.path.join(directory, hashlib.sha1(db_path.encode()).hexdigest()[:16])
+        self.chunk: float = chunk
+        self.max_size: int = max_size
+        self.lock: threading.Lock = threading.Lock()
+        self.files: "OrderedDict[str, int]" = OrderedDict()  # Size of each cached file, least recently used first
+        self.size: int = 0
+        self.pending: Dict[int, PendingChunk] = {}  # Open chunk of each sensor
+        self.writer: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(self.directory, exist_ok=True)
+        paths: List[str] = [os.path.join(root, name) for root, _, names in os.walk(self.directory)
+                            for name in names if not name.endswith(".tmp.npy")]
+        for path in sorted(paths, key=os.path.getmtime):
+            self.files[path] = os.path.getsize(path)
+            self.size += self.files[path]
+
+    def covered_ts(self, sensor_id: int) -> float:
+        """ Returns the timestamp until which the samples of the sensor were added, or -inf """
+        pending: PendingChunk = self.pending.get(sensor_id)
+        return pending.covered_ts if pending is not None else float("-inf")
+
+    def forget(self, sensor_id: int) -> None:
+        """ Drops the samples added for the sensor and not written yet, when it is no longer fetched """
+        self.pending.pop(sensor_id, None)
+
+    def path(self, sensor_id: int, index: int) -> str:
+        return os.path.join(self.directory, str(sensor_id), "%d.npy" % index)
+
+    def load(self, sensor_id: int, start_ts: float) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], float]:
+        """ Returns the cached samples of the sensor from start_ts, as timestamps/values views on each memory-mapped chunk,
+        and the timestamp they are complete until. Nothing is copied, the pages are only read when the views are """
+        chunks: List[Tuple[np.ndarray, np.ndarray]] = []
+        index: int = int(start_ts // self.chunk)
+        with self.lock:
+            while self.path(sensor_id, index) in self.files:
+                path: str = self.path(sensor_id, index)
+                self.files.move_to_end(path)
+                samples: np.ndarray = np.load(path, mmap_mode="r")
+                chunks.append((samples[0], samples[1]))
+                index += 1
+        if len(chunks) == 0:
+            return chunks, start_ts
+        first: int = int(np.searchsorted(chunks[0][0], start_ts, side="left"))
+        chunks[0] = (chunks[0][0][first:], chunks[0][1][first:])
+        return chunks, index * self.chunk
+
+    def add(self, sensor_id: int, timestamps: np.ndarray, values: np.ndarray, from_ts: float, to_ts: float) -> None:
+        """ Adds the samples of the sensor in [from_ts, to_ts], as fetched from the database, and writes the chunks closed by them.
+        A chunk is only written if the samples added cover it from its start without any gap. The caller keeps to_ts
+        behind the newest sample fetched, so that the samples committed late with older timestamps are still added """
+        pending: PendingChunk = self.pending.get(sensor_id)
+        if pending is not None and to_ts <= pending.covered_ts:
+            return  # Nothing new, e.g. the producer clock went back
+        if pending is not None and pending.covered_ts < from_ts:
+            del self.pending[sensor_id]  # Samples are missing
+            pending = None
+        if pending is not None:
+            first_index: int = pending.index
+        else:
+            first_index = int(from_ts // self.chunk)
+            if from_ts > first_index * self.chunk:
+                first_index += 1  # Started in the middle of a chunk
+        for index in range(first_index, int(to_ts // self.chunk) + 1):
+            if pending is None or pending.index < index:
+                if pending is not None:
+                    self.close(sensor_id, pending)
+                pending = PendingChunk(index)
+                self.pending[sensor_id] = pending
+            if pending.covered_ts < index * self.chunk:
+                start: int = int(np.searchsorted(timestamps, index * self.chunk, side="left"))
+            else:
+                start = int(np.searchsorted(timestamps, pending.covered_ts, side="right"))
+            if to_ts < (index + 1) * self.chunk:
+                end: int = int(np.searchsorted(timestamps, to_ts, side="right"))
+            else:
+                end = int(np.searchsorted(timestamps, (index + 1) * self.chunk, side="left"))
+            if end > start:
+                pending.timestamps.append(timestamps[start:end])
+                pending.values.append(values[start:end])
+            pending.covered_ts = min(to_ts, (index + 1) * self.chunk)
+
+    def close(self, sensor_id: int, pending: PendingChunk) -> None:
+        """ Writes a pending chunk if it is complete """
+        if pending.covered_ts < (pending.index + 1) * self.chunk:
+            return
+        path: str = self.path(sensor_id, pending.index)
+        if path in self.files:
+            return
+        samples: np.ndarray = np.stack((np.concatenate(pending.timestamps or [np.empty(0)]),
+                                        np.concatenate(pending.values or [np.empty(0)])))
+        self.writer.submit(self.write, path, samples)
+
+    def write(self, path: str, samples: np.ndarray) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under another name first, so that readers never map a partial file
+        np.save(path + ".tmp.npy", samples)
+        os.replace(path + ".tmp.npy", path)
+        with self.lock:
+            self.files[path] = os.path.getsize(path)
+            self.size += self.files[path]
+            while self.size > self.max_size and len(self.files) > 1:
+                evicted, size = self.files.popitem(last=False)
+                self.size -= size
+                os.remove(evicted)
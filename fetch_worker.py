@@ -0,0 +1,249 @@
+import sys
+import time
+from typing import List, Dict, Tuple
+
+import numpy as np
+from PyQt5 import QtCore
+from sqlalchemy.exc import SQLAlchemyError
+
+import app_config as cfg
+import data_query as dq
+import db
+import notify
+from instrumentation import stats
+from disk_cache import ChunkCache
+
+
+class FetchBatch:
+    """ New samples fetched by the worker for a given buffer generation, plus the attacks of the whole window.
+    If replace is set, the samples are a decimated version of the whole window and replace the buffered ones.
+    The cached samples, views on the memory-mapped chunks of the disk cache, come before the fetched ones of the same sensor """
+
+    def __init__(self, generation: int, data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]], attacks: Dict[str, List[Tuple[float, int]]],
+                 replace: bool = False, cached: Dict[str, Dict[str, List[Tuple[np.ndarray, np.ndarray]]]] = None):
+        self.generation: int = generation
+        self.replace: bool = replace
+        self.data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = data
+        self.attacks: Dict[str, List[Tuple[float, int]]] = attacks
+        self.cached: Dict[str, Dict[str, List[Tuple[np.ndarray, np.ndarray]]]] = cached or {}
+
+
+class DiscoveryWorker(QtCore.QObject):
+    """ Loads the tree of nodes and sensors from its own thread, so that the windows open before the database answers """
+    discovered = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    @QtCore.pyqtSlot()
+    def run(self) -> None:
+        try:
+            self.discovered.emit(dq.get_nodes_and_sensors())
+        except SQLAlchemyError as e:
+            dq.session.rollback()
+            self.failed.emit(str(e))
+        finally:
+            dq.session.remove()
+
+
+class FetchWorker(QtCore.QObject):
+    """ Polls the database from its own thread and session, and hands the new samples to the GUI thread.
+    In push mode, only the sensors notified as changed are fetched, with a full poll every resync interval """
+    dataReady = QtCore.pyqtSignal(object)
+
+    def __init__(self, _buffer: int, _interval: int = cfg.fetch_interval):
+        super().__init__()
+        self.buffer: int = _buffer
+        self.interval: int = _interval  # Polling interval in milliseconds
+        self.generation: int = 0
+        self.visibleSensors: Dict[str, List[str]] = {}
+        self.lastTs: Dict[Tuple[str, str], float] = {}
+        self.buckets: int = cfg.decimation_buckets
+        self.lastDecimated: float = float("-inf")
+        self.listener: notify.NotifyListener = None
+        self.lastFullPoll: float = float("-inf")
+        self.timer: QtCore.QTimer = None
+        self.cache: ChunkCache = None  # Opened in the worker thread, as it lists the cached files
+
+    @QtCore.pyqtSlot()
+    def start(self) -> None:
+        """ Starts polling. Must be called from the worker thread """
+        if cfg.cache_dir:
+            self.cache = ChunkCache(cfg.cache_dir, cfg.db_path, cfg.cache_chunk, cfg.cache_max_size)
+        try:
+            if notify.supported(db.engine):
+                self.listener = notify.NotifyListener(db.engine)
+        except Exception as e:
+            print("Push updates unavailable, polling instead: %s" % e, file=sys.stderr)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.interval)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start()
+
+    @QtCore.pyqtSlot()
+    def stop(self) -> None:
+        if self.timer is not None:
+            self.timer.stop()
+        if self.listener is not None:
+            self.listener.close()
+        dq.session.remove()
+
+    @QtCore.pyqtSlot(object)
+    def setVisibleSensors(self, visibleSensors: Dict[str, List[str]]) -> None:
+        self.visibleSensors = visibleSensors
+        self.lastDecimated = float("-inf")
+        self.lastFullPoll = float("-inf")
+
+    @QtCore.pyqtSlot(str, str)
+    def releaseSensor(self, node: str, sensor: str) -> None:
+        """ Forgets the rows sent for a sensor whose samples the GUI dropped, so that its whole window is fetched again once shown """
+        self.lastTs.pop((node, sensor), None)
+        if self.cache is not None:
+            self.cache.forget(dq.metadata.sensor_ids.get((node, sensor)))
+
+    @QtCore.pyqtSlot(int)
+    def setResolution(self, buckets: int) -> None:
+        """ Sets the number of time buckets used to decimate long windows, usually the plots width in pixels """
+        self.buckets = max(buckets, 1)
+
+    @QtCore.pyqtSlot(int, int)
+    def setBuffer(self, buffer: int, generation: int) -> None:
+        """ Changes the duration of the fetched window. A new generation means the GUI dropped its data, so the whole window is fetched again """
+        if generation != self.generation:
+            self.lastTs.clear()
+            self.generation = generation
+        self.buffer = buffer
+        self.lastDecimated = float("-inf")
+        self.lastFullPoll = float("-inf")
+
+    @QtCore.pyqtSlot()
+    def poll(self) -> None:
+        """ Fetches the new data of all the visible sensors, or only of the changed ones in push mode """
+        visibleNodes: List[str] = [n for n in self.visibleSensors.keys() if len(self.visibleSensors[n]) != 0]
+        if len(visibleNodes) == 0:
+            return
+        try:
+            if self.listener is not None and time.time() - self.lastFullPoll < cfg.push_resync_interval:
+                sensors, fetchAttacks = self.collectChanges()
+            else:
+                self.lastFullPoll = time.time()
+                sensors, fetchAttacks = self.visibleSensors, True
+            changedNodes: List[str] = [n for n in sensors.keys() if len(sensors[n]) != 0]
+            if len(changedNodes) == 0 and not fetchAttacks:
+                return  # Nothing changed
+            if self.buffer > cfg.raw_window:
+                self.pollDecimated(visibleNodes)
+            else:
+                self.pollRaw(changedNodes, sensors, fetchAttacks)
+        except SQLAlchemyError as e:
+            print("Fetch failed: %s" % e, file=sys.stderr)
+            dq.session.rollback()
+        finally:
+            # Return the connection to the pool instead of keeping a transaction open between polls
+            dq.session.close()
+
+    def collectChanges(self) -> Tuple[Dict[str, List[str]], bool]:
+        """ Returns the visible sensors with new measurements, and whether visible nodes have new attacks, according to the notifications """
+        try:
+            notifications: List[Dict] = self.listener.wait(0)
+        except Exception as e:
+            print("Push updates lost, polling instead: %s" % e, file=sys.stderr)
+            self.listener = None
+            return self.visibleSensors, True
+        changedSensors: set = set()
+        attacksChanged: bool = False
+        for notification in notifications:
+            if notification["kind"] == "attack":
+                node: str = dq.metadata.node_name(notification["node_id"])
+                attacksChanged = attacksChanged or len(self.visibleSensors.get(node, [])) != 0
+            else:
+                changedSensors.add(dq.metadata.sensor_name(notification["sensor_id"]))
+        sensors: Dict[str, List[str]] = {node: [s for s in self.visibleSensors[node] if (node, s) in changedSensors]
+                                         for node in self.visibleSensors.keys()}
+        return sensors, attacksChanged
+
+    def pollRaw(self, nodes: List[str], sensors: Dict[str, List[str]], fetchAttacks: bool = True) -> None:
+        """ Fetches the rows newer than the last ones sent for the given sensors, and the attacks of all the visible nodes """
+        now: float = time.time()
+        cutoff_ts: float = now - self.buffer
+        data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+        attacks: Dict[str, List[Tuple[float, int]]] = {}
+        cached: Dict[str, Dict[str, List[Tuple[np.ndarray, np.ndarray]]]] = {}
+        if len(nodes) != 0:
+            cached = self.loadCached(nodes, sensors, cutoff_ts)
+            sentTs: Dict[Tuple[str, str], float] = {(node, sensor): self.lastTs[(node, sensor)]
+                                                    for node in nodes for sensor in sensors[node]
+                                                    if (node, sensor) in self.lastTs and sensor not in cached.get(node, {})}
+            fetch_ts: float = min(max(self.fetchStart(node, sensor, cutoff_ts), cutoff_ts)
+                                  for node in nodes for sensor in sensors[node])
+            data = dq.get_data_arrays_batch_after_ts_all_nodes(nodes, sensors, fetch_ts)
+            if self.cache is not None:
+                with stats.timed("cache.store"):
+                    for node in nodes:
+                        for sensor in sensors[node]:
+                            timestamps, values = data[node][sensor]
+                            # Rows may still be committed with timestamps up to cache_lag before the newest one,
+                            # and the producer clock may be ahead of ours
+                            newest_ts: float = min(now, timestamps[-1]) if len(timestamps) != 0 else now
+                            self.cache.add(dq.get_sensor_id(sensor, node), timestamps, values,
+                                           fetch_ts, newest_ts - cfg.cache_lag)
+            # The rows fetched again for the cache were already sent
+            for (node, sensor), last_ts in sentTs.items():
+                timestamps, values = data[node][sensor]
+                first: int = int(np.searchsorted(timestamps, last_ts, side="right"))
+                if first != 0:
+                    data[node][sensor] = (timestamps[first:], values[first:])
+            for node in cached.keys():
+                for sensor in cached[node].keys():
+                    # The database rows start at the end of the cached ones
+                    fetched_ts, fetched_values = data[node][sensor]
+                    first: int = int(np.searchsorted(fetched_ts, self.lastTs[(node, sensor)], side="left"))
+                    data[node][sensor] = (fetched_ts[first:], fetched_values[first:])
+        if fetchAttacks:
+            attackNodes: List[str] = [n for n in self.visibleSensors.keys() if len(self.visibleSensors[n]) != 0]
+            attacks = dq.get_attacks_after_ts_all_nodes(attackNodes, cutoff_ts)
+        for node in nodes:
+            for sensor in sensors[node]:
+                timestamps: np.ndarray = data[node][sensor][0]
+                if len(timestamps) != 0:
+                    self.lastTs[(node, sensor)] = float(timestamps[-1])
+        self.dataReady.emit(FetchBatch(self.generation, data, attacks, cached=cached))
+
+    def fetchStart(self, node: str, sensor: str, cutoff_ts: float) -> float:
+        """ Returns the timestamp from which the rows of the sensor must be fetched: after the last row sent,
+        or from the end of the samples added to the cache if it is earlier """
+        start_ts: float = self.lastTs.get((node, sensor), cutoff_ts)
+        if self.cache is not None:
+            covered_ts: float = self.cache.covered_ts(dq.get_sensor_id(sensor, node))
+            if covered_ts != float("-inf"):  # Nothing added yet otherwise
+                start_ts = min(start_ts, covered_ts)
+        return start_ts
+
+    def loadCached(self, nodes: List[str], sensors: Dict[str, List[str]], cutoff_ts: float) -> Dict[str, Dict[str, List[Tuple[np.ndarray, np.ndarray]]]]:
+        """ Loads the window of the sensors fetched for the first time from the disk cache, so that only the rest gets fetched from the database.
+        Returns views on the cached chunks, they are only copied once, into the ring buffers of the GUI """
+        cached: Dict[str, Dict[str, List[Tuple[np.ndarray, np.ndarray]]]] = {}
+        if self.cache is None:
+            return cached
+        with stats.timed("cache.load"):
+            for node in nodes:
+                for sensor in sensors[node]:
+                    if (node, sensor) in self.lastTs:
+                        continue
+                    chunks, covered_ts = self.cache.load(dq.get_sensor_id(sensor, node), cutoff_ts)
+                    if covered_ts > cutoff_ts:
+                        cached.setdefault(node, {})[sensor] = chunks
+                        self.lastTs[(node, sensor)] = covered_ts
+        return cached
+
+    def pollDecimated(self, visibleNodes: List[str]) -> None:
+        """ Fetches the whole window decimated by the database. Done at most once per bucket width, as nothing visible changes in between """
+        now: float = time.time()
+        if now - self.lastDecimated < self.buffer / self.buckets:
+            return
+        self.lastDecimated = now
+        self.lastTs.clear()
+        cutoff_ts: float = now - self.buffer
+        data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = dq.get_data_arrays_decimated_all_nodes(
+            visibleNodes, self.visibleSensors, cutoff_ts, now, self.buckets)
+        attacks: Dict[str, List[Tuple[float, int]]] = dq.get_attacks_after_ts_all_nodes(
+            visibleNodes, cutoff_ts)
+        self.dataReady.emit(FetchBatch(self.generation, data, attacks, replace=True))
@@ -0,0 +1,75 @@
+import time
+from typing import Callable, List
+
+from PyQt5 import QtCore
+
+import app_config as cfg
+
+
+class FrameScheduler(QtCore.QObject):
+    """ Calls the draw function at most at the target frame rate, and only when something changed since the last frame.
+    Backs off to the idle interval while nothing is visible """
+    statsUpdated = QtCore.pyqtSignal(float, float, float)  # Achieved FPS, mean frame time (ms), frame budget (ms)
+
+    def __init__(self, _draw: Callable[[], None], _isVisible: Callable[[], bool],
+                 _targetFps: float = cfg.target_fps, _idleInterval: int = cfg.idle_interval):
+        super().__init__()
+        self.draw: Callable[[], None] = _draw
+        self.isVisible: Callable[[], bool] = _isVisible
+        self.targetFps: float = _targetFps
+        self.idleInterval: int = _idleInterval  # Timeout in milliseconds
+        self.dirty: bool = True
+        self.frameTimes: List[float] = []
+        self.statsStart: float = time.perf_counter()
+        self.fps: float = 0.
+        self.frameTime: float = 0.
+        self.timer: QtCore.QTimer = QtCore.QTimer()
+        self.timer.setInterval(self.frameInterval())
+        self.timer.timeout.connect(self.tick)
+
+    def frameInterval(self) -> int:
+        """ Returns the timer interval matching the target FPS, in milliseconds """
+        return int(1000 / self.targetFps)
+
+    def frameBudget(self) -> float:
+        """ Returns the time available to draw one frame, in milliseconds """
+        return 1000. / self.targetFps
+
+    def start(self) -> None:
+        self.timer.start()
+
+    def stop(self) -> None:
+        self.timer.stop()
+
+    def setTargetFps(self, fps: float) -> None:
+        self.targetFps = fps
+        self.timer.setInterval(self.frameInterval())
+
+    def markDirty(self) -> None:
+        """ Requests a redraw on the next frame """
+        self.dirty = True
+
+    def tick(self) -> None:
+        if not self.isVisible():
+            self.timer.setInterval(self.idleInterval)
+            self.updateStats()
+            return
+        if self.timer.interval() != self.frameInterval():
+            self.timer.setInterval(self.frameInterval())
+        if self.dirty:
+            self.dirty = False
+            start: float = time.perf_counter()
+            self.draw()
+            self.frameTimes.append(time.perf_counter() - start)
+        self.updateStats()
+
+    def updateStats(self) -> None:
+        """ Computes the achieved FPS and mean frame time about once per second """
+        elapsed: float = time.perf_counter() - self.statsStart
+        if elapsed < 1.:
+            return
+        self.fps = len(self.frameTimes) / elapsed
+        self.frameTime = 1000. * sum(self.frameTimes) / len(self.frameTimes) if len(self.frameTimes) != 0 else 0.
+        self.frameTimes = []
+        self.statsStart = time.perf_counter()
+        self.statsUpdated.emit(self.fps, self.frameTime, self.frameBudget())
@@ -0,0 +1,82 @@
+# Wire format between data_server.py and its clients.
+# A frame is a JSON header followed by a binary body, each prefixed by its length:
+#   uint32 header length | uint32 body length | header (UTF-8 JSON) | body
+# Data frames list their sensors in the header as [node, sensor, samples] and carry, for each sensor in that order,
+# its float64 timestamps then its float64 values (little-endian), so that clients read them without parsing.
+
+import json
+import socket
+import struct
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+PREFIX: struct.Struct = struct.Struct("<II")
+DTYPE: np.dtype = np.dtype("<f8")
+
+
+def encode_frame(header: dict, body: bytes = b"") -> bytes:
+    header_bytes: bytes = json.dumps(header).encode()
+    return PREFIX.pack(len(header_bytes), len(body)) + header_bytes + body
+
+
+def encode_data(header: dict, data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]) -> bytes:
+    """ Returns a data frame carrying the given timestamps/values of each node/sensor """
+    sensors: List[list] = []
+    columns: List[bytes] = []
+    for node in data.keys():
+        for sensor, (timestamps, values) in data[node].items():
+            sensors.append([node, sensor, len(timestamps)])
+            columns.append(np.ascontiguousarray(timestamps, dtype=DTYPE).tobytes())
+            columns.append(np.ascontiguousarray(values, dtype=DTYPE).tobytes())
+    return encode_frame(dict(header, sensors=sensors), b"".join(columns))
+
+
+def decode_data(header: dict, body: bytes) -> Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """ Returns the timestamps/values of each node/sensor of a data frame, as views on its body """
+    data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+    offset: int = 0
+    for node, sensor, count in header["sensors"]:
+        timestamps: np.ndarray = np.frombuffer(body, dtype=DTYPE, count=count, offset=offset)
+        offset += count * DTYPE.itemsize
+        values: np.ndarray = np.frombuffer(body, dtype=DTYPE, count=count, offset=offset)
+        offset += count * DTYPE.itemsize
+        data.setdefault(node, {})[sensor] = (timestamps, values)
+    return data
+
+
+def split_frames(buffer: bytearray) -> List[Tuple[dict, bytes]]:
+    """ Removes the complete frames from the start of the buffer and returns their header and body """
+    frames: List[Tuple[dict, bytes]] = []
+    while len(buffer) >= PREFIX.size:
+        header_size, body_size = PREFIX.unpack_from(buffer)
+        end: int = PREFIX.size + header_size + body_size
+        if len(buffer) < end:
+            break
+        header: dict = json.loads(bytes(buffer[PREFIX.size:PREFIX.size + header_size]))
+        frames.append((header, bytes(buffer[PREFIX.size + header_size:end])))
+        del buffer[:end]
+    return frames
+
+
+def read_frame(sock: socket.socket) -> Tuple[dict, bytes]:
+    """ Reads one frame from a blocking socket. Returns (None, None) once the peer closed the connection """
+    prefix: bytes = read_exactly(sock, PREFIX.size)
+    if prefix is None:
+        return None, None
+    header_size, body_size = PREFIX.unpack(prefix)
+    payload: bytes = read_exactly(sock, header_size + body_size)
+    if payload is None:
+        return None, None
+    return json.loads(payload[:header_size]), payload[header_size:]
+
+
+def read_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks: List[bytes] = []
+    while size > 0:
+        chunk: bytes = sock.recv(min(size, 1 << 20))
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
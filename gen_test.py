@@ -1,16 +1,20 @@
 # Generates test data used to test and debug plotter
+# Usage: python gen_test.py for a few slow sensors, or python gen_test.py --bulk --help for load tests
 
+import argparse
+import io
+import multiprocessing as mp
 import random as rd
 import time
 import math
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
-from bookkeeper.sql import create_sessions, Node, Sensor, Measurement, Event, Attack
+from bookkeeper.sql import Node, Sensor, Measurement, Event, Attack
 
 import data_query as dq
-import app_config as cfg
+import db
 
-session = create_sessions(cfg.db_path)
+session = db.session
 
 nodes: List[str] = [
     "node_1",
@@ -61,6 +65,7 @@ def add_node(name: str):
         newNode = Node(name=name)
         session.add(newNode)
         session.commit()
+        dq.metadata.invalidate()
         # session.flush()
 
 
@@ -86,6 +91,7 @@ def add_sensor(name: str, unit: str, avg: float, std: float, node: int):
                            std=std, node_id=node)
         session.add(newSensor)
         session.commit()
+        dq.metadata.invalidate()
         # session.flush()
 
 
@@ -96,8 +102,8 @@ def add_attack(ts: float, attack_type: int, node: int) -> None:
     session.commit()
 
 
-if __name__ == "__main__":
-    # Get missing nodes and sensors
+def create_nodes_and_sensors(nodes: List[str], sensors: Dict[str, List[str]]) -> None:
+    """ Adds the nodes and sensors missing from the database """
     curr_nodes: List[str] = dq.get_all_nodes()
     missing_nodes = [n for n in nodes if n not in curr_nodes]
     curr_sensors: Dict[str, List[str]] = {}
@@ -107,7 +113,6 @@ if __name__ == "__main__":
         missing_sensors[node] = [n for n in sensors[node]
                                  if n not in curr_sensors[node]]
 
-    # Add missing nodes and sensors
     for node in missing_nodes:
         print("Adding node %s" % node)
         add_node(node)
@@ -116,7 +121,10 @@ if __name__ == "__main__":
             print("Adding sensor %s/%s" % (node, sensor))
             add_sensor(sensor, "N/A", 0, 0, dq.get_node_id(node))
 
-    # Start adding data on a loop
+
+def run_live() -> None:
+    """ Adds one measurement per sensor every 0.5 s, and an attack every 5 s """
+    create_nodes_and_sensors(nodes, sensors)
     attack_counter: int = 0
     attack_period: int = 10
     while True:
@@ -133,3 +141,126 @@ if __name__ == "__main__":
             node_id = dq.get_node_id(rd.choice(nodes))
             add_attack(meas_time, 0, node_id)
         time.sleep(0.5)
+
+
+def insert_measurements(rows: List[Tuple[float, float, int, int]], use_copy: bool) -> None:
+    """ Inserts timestamp/value/sensor_id/node_id rows in a single round trip, with COPY on PostgreSQL if requested """
+    if use_copy:
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("%r\t%r\t%d\t%d\n" % row)
+        buffer.seek(0)
+        table = Measurement.__table__
+        cursor = session.connection().connection.cursor()
+        cursor.copy_from(buffer, table.name, columns=(table.c.timestamp.name, table.c.value.name,
+                                                      table.c.sensor_id.name, table.c.node_id.name))
+        cursor.close()
+    else:
+        session.execute(Measurement.__table__.insert(),
+                        [{"timestamp": r[0], "value": r[1], "sensor_id": r[2], "node_id": r[3]} for r in rows])
+    session.commit()
+
+
+def rate_factor(ts: float, args: argparse.Namespace) -> float:
+    """ Returns the rate multiplier at the given time: burst_factor during the first burst_duration seconds of each burst_period """
+    if args.burst_period > 0 and ts % args.burst_period < args.burst_duration:
+        return args.burst_factor
+    return 1.
+
+
+def flush_measurements(rows: List[Tuple[float, float, int, int]], use_copy: bool, counter) -> None:
+    """ Inserts a batch of measurements and adds them to the shared row counter """
+    insert_measurements(rows, use_copy)
+    with counter.get_lock():
+        counter.value += len(rows)
+
+
+def bulk_producer(sensor_ids: List[Tuple[int, int]], args: argparse.Namespace, counter) -> None:
+    """ Produces measurements for the given sensor/node IDs at the requested rate (unthrottled if the rate is 0), in batches """
+    db.engine.dispose()  # Do not share the parent process connections
+    use_copy: bool = args.copy and db.engine.dialect.name == "postgresql"
+    rows: List[Tuple[float, float, int, int]] = []
+    next_ts: float = time.time()
+    deadline: float = next_ts + args.duration if args.duration > 0 else float("inf")
+    while next_ts < deadline:
+        now: float = time.time()
+        if args.rate > 0 and next_ts > now:
+            # Caught up with the requested rate
+            if len(rows) != 0:
+                flush_measurements(rows, use_copy, counter)
+                rows = []
+            time.sleep(next_ts - now)
+        ts: float = next_ts if args.rate > 0 else now
+        value: float = math.sin(ts / 3.)
+        rows.extend((ts, value + rd.gauss(0, 0.1), sensor_id, node_id) for sensor_id, node_id in sensor_ids)
+        if args.rate > 0:
+            next_ts += 1. / (args.rate * rate_factor(next_ts, args))
+        else:
+            next_ts = now
+        if len(rows) >= args.batch_size:
+            flush_measurements(rows, use_copy, counter)
+            rows = []
+    # The last batch is pending when the duration is over
+    if len(rows) != 0:
+        flush_measurements(rows, use_copy, counter)
+
+
+def run_bulk(args: argparse.Namespace) -> None:
+    """ Generates load with many nodes/sensors, batched inserts and several processes, and reports the sustained rows/s """
+    bulk_nodes: List[str] = ["node_%d" % n for n in range(1, args.nodes + 1)]
+    bulk_sensors: Dict[str, List[str]] = {n: ["sensor_%d" % s for s in range(1, args.sensors + 1)] for n in bulk_nodes}
+    create_nodes_and_sensors(bulk_nodes, bulk_sensors)
+    sensor_ids: List[Tuple[int, int]] = [(dq.get_sensor_id(s, n), dq.get_node_id(n))
+                                         for n in bulk_nodes for s in bulk_sensors[n]]
+    db.session.remove()
+    counter = mp.Value("l", 0)
+    processes: List[mp.Process] = [mp.Process(target=bulk_producer, args=(sensor_ids[i::args.processes], args, counter), daemon=True)
+                                   for i in range(args.processes)]
+    start: float = time.time()
+    for p in processes:
+        p.start()
+    last_ts, last_count = start, 0
+    next_attack: float = start + args.attack_period if args.attack_period > 0 else float("inf")
+    try:
+        while any(p.is_alive() for p in processes):
+            time.sleep(args.report_interval)
+            now, count = time.time(), counter.value
+            print("%d rows, %.0f rows/s (%.0f rows/s overall)" % (
+                count, (count - last_count) / (now - last_ts), count / (now - start)))
+            last_ts, last_count = now, count
+            if now >= next_attack:
+                add_attack(now, 0, dq.get_node_id(rd.choice(bulk_nodes)))
+                next_attack += args.attack_period
+    except KeyboardInterrupt:
+        pass
+    elapsed: float = time.time() - start
+    print("Sustained %.0f rows/s over %.1f s (%d rows)" % (counter.value / elapsed, elapsed, counter.value))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generates test data for the plotter")
+    parser.add_argument("--bulk", action="store_true", help="high-throughput load generation mode")
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--sensors", type=int, default=10, help="sensors per node")
+    parser.add_argument("--rate", type=float, default=10., help="samples per second and per sensor, 0 for as fast as possible")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per insert")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--copy", action="store_true", help="insert with COPY (PostgreSQL only)")
+    parser.add_argument("--burst-factor", type=float, default=1., help="rate multiplier during bursts")
+    parser.add_argument("--burst-period", type=float, default=0., help="seconds between two bursts, 0 for no bursts")
+    parser.add_argument("--burst-duration", type=float, default=0., help="duration of a burst (s)")
+    parser.add_argument("--attack-period", type=float, default=5., help="seconds between two attacks, 0 for none")
+    parser.add_argument("--duration", type=float, default=0., help="stop after this many seconds, 0 to run until interrupted")
+    parser.add_argument("--report-interval", type=float, default=1.)
+    parser.add_argument("--create-schema", action="store_true", help="create the missing tables first, for a new test database")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.create_schema:
+        Measurement.metadata.create_all(db.engine)
+    if args.bulk:
+        run_bulk(args)
+    else:
+        run_live()
@@ -0,0 +1,195 @@
+# Hot storage of the recent measurements, so that the live queries do not slow down as the measurements table grows.
+# A trigger copies the new measurements to a table range partitioned by time (PostgreSQL 10+), which the plotter reads
+# automatically for the windows it covers. The retention job creates the partitions ahead of time and drops the old ones.
+# Install it once, then run the retention job alongside the data producer:
+#   python hot_storage.py install
+#   python hot_storage.py
+
+import sys
+import time
+from typing import List, Tuple
+
+from sqlalchemy import MetaData, Table, Column, Integer, Float, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from bookkeeper.sql import Measurement
+
+import app_config as cfg
+import db
+
+_measurements = Measurement.__table__
+
+hot_metadata: MetaData = MetaData()
+
+# Same columns as the measurements table, only the ones queried by the plotter are declared
+hot_table: Table = Table(
+    "measurement_hot", hot_metadata,
+    Column(_measurements.c.timestamp.name, Float, key="timestamp"),
+    Column(_measurements.c.value.name, Float, key="value"),
+    Column(_measurements.c.sensor_id.name, Integer, key="sensor_id"),
+    Column(_measurements.c.node_id.name, Integer, key="node_id"))
+
+# The hot table holds all the measurements in [start_ts, end_ts), the bounds of its partitions
+hot_state: Table = Table(
+    "measurement_hot_state", hot_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("start_ts", Float, nullable=False),
+    Column("end_ts", Float, nullable=False))
+
+TABLES_SQL: str = """
+CREATE TABLE "{state}" (id integer PRIMARY KEY, start_ts double precision NOT NULL, end_ts double precision NOT NULL);
+CREATE TABLE "{hot}" (LIKE "{measurements}") PARTITION BY RANGE ("{timestamp}");
+"""
+
+# One copy per inserting statement. Measurements outside of the partitions are only kept in the measurements table
+TRIGGER_SQL: str = """
+CREATE OR REPLACE FUNCTION plotter_copy_hot_measurements() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO "{hot}" SELECT new_rows.* FROM new_rows, "{state}" AS state
+    WHERE new_rows."{timestamp}" >= state.start_ts AND new_rows."{timestamp}" < state.end_ts;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS plotter_hot ON "{measurements}";
+CREATE TRIGGER plotter_hot AFTER INSERT ON "{measurements}"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE plotter_copy_hot_measurements();
+"""
+
+
+def format_sql(sql: str) -> str:
+    return sql.format(hot=hot_table.name, state=hot_state.name,
+                      measurements=_measurements.name, timestamp=_measurements.c.timestamp.name)
+
+
+def supported(engine: Engine) -> bool:
+    """The hot storage needs PostgreSQL, other backends always read the measurements table"""
+    return cfg.use_hot_storage and engine.dialect.name == "postgresql"
+
+
+def tables_exist(engine: Engine) -> bool:
+    return engine.has_table(hot_state.name)
+
+
+def get_state(session) -> Tuple[float, float]:
+    """Returns the start/end timestamps of the measurements held by the hot table"""
+    row = session.execute(select([hot_state.c.start_ts, hot_state.c.end_ts])).first()
+    return row.start_ts, row.end_ts
+
+
+def partition_name(start_ts: float) -> str:
+    return "%s_%d" % (hot_table.name, start_ts)
+
+
+def create_partitions(connection, now: float) -> int:
+    """Creates the partitions up to hot_partitions_ahead partitions after now. Returns the number of partitions created"""
+    end_ts: float = connection.execute(select([hot_state.c.end_ts])).scalar()
+    created: int = 0
+    while end_ts < (now // cfg.hot_partition + 1 + cfg.hot_partitions_ahead) * cfg.hot_partition:
+        name: str = partition_name(end_ts)
+        connection.execute('CREATE TABLE "%s" PARTITION OF "%s" FOR VALUES FROM (%r) TO (%r)' % (
+            name, hot_table.name, end_ts, end_ts + cfg.hot_partition))
+        # Indexed per partition, PostgreSQL 10 does not index partitioned tables
+        connection.execute('CREATE INDEX "%s_sensor_ts" ON "%s" ("%s", "%s")' % (
+            name, name, _measurements.c.sensor_id.name, _measurements.c.timestamp.name))
+        end_ts += cfg.hot_partition
+        created += 1
+    connection.execute(hot_state.update().values(end_ts=end_ts))
+    return created
+
+
+def drop_partitions(connection, now: float) -> int:
+    """Drops the partitions older than hot_retention. Returns the number of partitions dropped.
+    One more partition than needed is kept, so that the plotter never reads a partition being dropped"""
+    partitions: List[str] = [row[0] for row in connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "WHERE parent.relname = :parent"), parent=hot_table.name)]
+    starts: List[float] = sorted(float(name.rsplit("_", 1)[1]) for name in partitions)
+    cutoff_ts: float = now - cfg.hot_retention - cfg.hot_partition
+    dropped: List[float] = [start_ts for start_ts in starts if start_ts + cfg.hot_partition <= cutoff_ts]
+    if len(dropped) == 0:
+        return 0
+    # Dropping a partition locks the hot table, give up until the next run rather than queueing the plotter queries
+    connection.execute("SET LOCAL lock_timeout = '1s'")
+    connection.execute(hot_state.update().values(start_ts=dropped[-1] + cfg.hot_partition))
+    for start_ts in dropped:
+        connection.execute('DROP TABLE "%s"' % partition_name(start_ts))
+    return len(dropped)
+
+
+def delete_old_measurements(engine: Engine, now: float) -> int:
+    """Deletes the measurements older than measurement_retention from the measurements table, in small transactions
+    so that the producer is never blocked for long. Returns the number of measurements deleted"""
+    before_ts: float = now - max(cfg.measurement_retention, cfg.hot_retention)
+    deleted: int = 0
+    while True:
+        with engine.begin() as connection:
+            count: int = connection.execute(text(
+                'DELETE FROM "{measurements}" WHERE ctid = ANY(ARRAY('
+                'SELECT ctid FROM "{measurements}" WHERE "{timestamp}" < :before_ts LIMIT :batch))'.format(
+                    measurements=_measurements.name, timestamp=_measurements.c.timestamp.name)),
+                before_ts=before_ts, batch=cfg.retention_batch).rowcount
+        deleted += count
+        if count < cfg.retention_batch:
+            return deleted
+
+
+def install(engine: Engine, now: float = None) -> None:
+    """Creates the hot table, fills it with the measurements of the retention period, and installs the copy trigger.
+    All at once, so that no measurement inserted meanwhile is missed"""
+    if now is None:
+        now = time.time()
+    start_ts: float = ((now - cfg.hot_retention) // cfg.hot_partition) * cfg.hot_partition
+    with engine.begin() as connection:
+        connection.execute(text(format_sql(TABLES_SQL)))
+        connection.execute(hot_state.insert().values(id=1, start_ts=start_ts, end_ts=start_ts))
+        create_partitions(connection, now)
+        # Blocks the inserts until the end of the transaction, the following copy sees all the measurements before the trigger
+        connection.execute(text(format_sql(TRIGGER_SQL)))
+        end_ts: float = connection.execute(select([hot_state.c.end_ts])).scalar()
+        connection.execute(text(
+            'INSERT INTO "{hot}" SELECT * FROM "{measurements}" '
+            'WHERE "{timestamp}" >= :start_ts AND "{timestamp}" < :end_ts'.format(
+                hot=hot_table.name, measurements=_measurements.name, timestamp=_measurements.c.timestamp.name)),
+            start_ts=start_ts, end_ts=end_ts)
+
+
+def run_retention(engine: Engine, now: float = None) -> Tuple[int, int, int]:
+    """Creates the upcoming partitions and drops the expired ones. Returns the number of partitions created and dropped,
+    and of measurements deleted from the measurements table"""
+    if now is None:
+        now = time.time()
+    with engine.begin() as connection:
+        created: int = create_partitions(connection, now)
+    with engine.begin() as connection:
+        dropped: int = drop_partitions(connection, now)
+    deleted: int = delete_old_measurements(engine, now) if cfg.measurement_retention > 0 else 0
+    return created, dropped, deleted
+
+
+if __name__ == "__main__":
+    if db.engine.dialect.name != "postgresql":
+        print("The hot storage is only supported on PostgreSQL")
+        sys.exit(1)
+    if len(sys.argv) == 2 and sys.argv[1] == "install":
+        if tables_exist(db.engine):
+            print("The hot storage is already installed")
+            sys.exit(1)
+        install(db.engine)
+        print("Installed the hot storage of the last %ds of measurements" % cfg.hot_retention)
+        sys.exit(0)
+    if len(sys.argv) != 1:
+        print("Usage: python hot_storage.py [install]")
+        sys.exit(1)
+    while True:
+        try:
+            created, dropped, deleted = run_retention(db.engine)
+        except SQLAlchemyError as e:  # e.g. a lock timeout, retried on the next run
+            print("Retention failed: %s" % e, file=sys.stderr)
+        else:
+            if created + dropped + deleted != 0:
+                print("Created %d partitions, dropped %d partitions, deleted %d measurements" % (created, dropped, deleted))
+        time.sleep(cfg.hot_maintenance_interval)
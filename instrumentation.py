@@ -0,0 +1,112 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, Iterator, List
+
+import app_config as cfg
+
+
+class RollingHistogram:
+    """ Keeps the last samples of a metric and summarizes their distribution """
+
+    def __init__(self, size: int):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.total: int = 0  # Number of samples ever recorded
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+        self.total += 1
+
+    def summary(self) -> Dict[str, float]:
+        values: List[float] = sorted(self.samples)
+        if len(values) == 0:
+            return {"count": self.total}
+
+        def percentile(p: float) -> float:
+            return values[min(int(p * len(values)), len(values) - 1)]
+        return {
+            "count": self.total,
+            "mean": sum(values) / len(values),
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": values[-1]
+        }
+
+
+class Stats:
+    """ Thread-safe registry of rolling histograms. Timers are recorded in milliseconds """
+
+    def __init__(self, size: int = cfg.stats_window):
+        self.size: int = size
+        self.histograms: Dict[str, RollingHistogram] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def record(self, name: str, value: float) -> None:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = RollingHistogram(self.size)
+            self.histograms[name].add(value)
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        """ Records the duration of the enclosed block """
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000.)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+    def format_text(self) -> str:
+        """ Returns one line per metric, ready to be displayed """
+        lines: List[str] = []
+        for name, summary in self.snapshot().items():
+            if "mean" not in summary:
+                continue
+            lines.append("%-28s n=%-7d mean=%8.2f p50=%8.2f p99=%8.2f max=%8.2f" % (
+                name, summary["count"], summary["mean"], summary["p50"], summary["p99"], summary["max"]))
+        return "\n".join(lines)
+
+
+stats: Stats = Stats()
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """ Serves the statistics as JSON on /stats.json, and as plain text on any other path """
+
+    def do_GET(self) -> None:
+        if self.path == "/stats.json":
+            body: bytes = json.dumps(stats.snapshot()).encode()
+            contentType: str = "application/json"
+        else:
+            body = stats.format_text().encode()
+            contentType = "text/plain"
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # Do not log every request
+
+
+def start_exporters() -> None:
+    """ Starts the optional statistics HTTP endpoint and periodic log line, as configured """
+    if cfg.stats_port != 0:
+        server = ThreadingHTTPServer(("127.0.0.1", cfg.stats_port), StatsRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    if cfg.stats_log_interval != 0:
+        def log_stats() -> None:
+            while True:
+                time.sleep(cfg.stats_log_interval)
+                print("stats %s" % json.dumps(stats.snapshot()), file=sys.stderr)
+        threading.Thread(target=log_stats, daemon=True).start()
@@ -0,0 +1,106 @@
+# Push notifications of new measurements and attacks through PostgreSQL LISTEN/NOTIFY.
+# Install the triggers once with: python notify.py install
+
+import json
+import select
+import sys
+from typing import List, Dict
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from bookkeeper.sql import Measurement, Attack
+
+import app_config as cfg
+import db
+
+# One notification per node/sensor (or node, for attacks) and per inserting statement
+TRIGGERS_SQL: str = """
+CREATE OR REPLACE FUNCTION plotter_notify_measurements() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', json_build_object(
+        'kind', 'measurement', 'node_id', node_id, 'sensor_id', sensor_id, 'timestamp', ts)::text)
+    FROM (SELECT node_id, sensor_id, max("timestamp") AS ts FROM new_rows GROUP BY node_id, sensor_id) AS changed;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION plotter_notify_attacks() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', json_build_object(
+        'kind', 'attack', 'node_id', node_id, 'timestamp', ts)::text)
+    FROM (SELECT node_id, max("timestamp") AS ts FROM new_rows GROUP BY node_id) AS changed;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS plotter_notify ON "{measurements}";
+CREATE TRIGGER plotter_notify AFTER INSERT ON "{measurements}"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE plotter_notify_measurements();
+
+DROP TRIGGER IF EXISTS plotter_notify ON "{attacks}";
+CREATE TRIGGER plotter_notify AFTER INSERT ON "{attacks}"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE plotter_notify_attacks();
+"""
+
+
+def supported(engine: Engine) -> bool:
+    """Push updates need PostgreSQL and the triggers installed by this script, otherwise the database is polled"""
+    return cfg.push_updates and engine.dialect.name == "postgresql" and triggers_installed(engine)
+
+
+def triggers_installed(engine: Engine) -> bool:
+    """Checks that the notification triggers exist on both the measurements and attacks tables"""
+    with engine.connect() as connection:
+        count: int = connection.execute(text(
+            "SELECT count(*) FROM pg_trigger "
+            "WHERE tgname = 'plotter_notify' AND tgrelid IN (CAST(:measurements AS regclass), CAST(:attacks AS regclass))"),
+            measurements='"%s"' % Measurement.__table__.name, attacks='"%s"' % Attack.__table__.name).scalar()
+    return count == 2
+
+
+def install_triggers(engine: Engine) -> None:
+    """Creates the triggers notifying the inserts on the measurements and attacks tables (PostgreSQL 10+)"""
+    sql: str = TRIGGERS_SQL.format(channel=cfg.notify_channel,
+                                   measurements=Measurement.__table__.name,
+                                   attacks=Attack.__table__.name)
+    with engine.begin() as connection:
+        connection.execute(text(sql))
+
+
+class NotifyListener:
+    """Listens to the notifications on a dedicated connection, outside of the connection pool"""
+
+    def __init__(self, engine: Engine):
+        import psycopg2
+        import psycopg2.extensions
+        args, kwargs = engine.dialect.create_connect_args(engine.url)
+        self.connection = psycopg2.connect(*args, **kwargs)
+        self.connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.connection.cursor() as cursor:
+            cursor.execute("LISTEN %s" % cfg.notify_channel)
+
+    def wait(self, timeout: float) -> List[Dict]:
+        """Returns the notifications received, waiting up to timeout seconds for the first one"""
+        if len(self.connection.notifies) == 0:
+            readable, _, _ = select.select([self.connection], [], [], timeout)
+            if len(readable) == 0:
+                return []
+        self.connection.poll()
+        notifications: List[Dict] = [json.loads(n.payload) for n in self.connection.notifies]
+        self.connection.notifies.clear()
+        return notifications
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "install":
+        print("Usage: python notify.py install")
+        sys.exit(1)
+    if db.engine.dialect.name != "postgresql":
+        print("Push updates are only supported on PostgreSQL")
+        sys.exit(1)
+    install_triggers(db.engine)
+    print("Installed the notification triggers on channel %s" % cfg.notify_channel)
@@ -0,0 +1,94 @@
+from typing import List, Tuple
+
+import numpy as np
+import pyqtgraph as pg
+
+import app_config as cfg
+from columnar import minmax_decimate
+
+
+class WindowAxis(pg.AxisItem):
+    """ Time axis of plots whose x values are epoch timestamps, labelled in seconds from the start of the visible window """
+
+    def tickValues(self, minVal, maxVal, size):
+        # Place the ticks at round offsets from the start of the window rather than at round timestamps
+        return [(spacing, [v + minVal for v in values]) for spacing, values in super().tickValues(0, maxVal - minVal, size)]
+
+    def tickStrings(self, values, scale, spacing):
+        return super().tickStrings([v - self.range[0] for v in values], scale, spacing)
+
+
+class SegmentedCurve:
+    """ Curve plotted in absolute (epoch) x coordinates, split into several items so that it can be appended to.
+    New samples only update the last, open segment. Full segments are decimated once, then left untouched until they leave the window """
+
+    def __init__(self, _plot: pg.PlotItem, _pen, _segmentSize: int = cfg.curve_segment_size):
+        self.plot: pg.PlotItem = _plot
+        self.pen = _pen
+        self.segmentSize: int = _segmentSize
+        self.bucketWidth: float = 0.  # Decimation bucket width of the full segments (s), 0 to keep all their samples
+        self.segments: List[pg.PlotCurveItem] = []  # Full segments, oldest first
+        self.segmentRanges: List[Tuple[float, float, float]] = []  # Last timestamp, min and max value of each full segment
+        self.tail: pg.PlotCurveItem = pg.PlotCurveItem(pen=_pen)
+        self.tailTs: np.ndarray = np.empty(0)
+        self.tailValues: np.ndarray = np.empty(0)
+        self.plot.addItem(self.tail)
+
+    @property
+    def lastTs(self) -> float:
+        """ Timestamp of the newest sample plotted, or -inf if the curve is empty """
+        if len(self.tailTs) == 0:
+            return float("-inf")
+        return float(self.tailTs[-1])
+
+    def append(self, timestamps: np.ndarray, values: np.ndarray) -> None:
+        """ Appends samples newer than lastTs, sorted by timestamp """
+        self.tailTs = np.concatenate((self.tailTs, timestamps))
+        self.tailValues = np.concatenate((self.tailValues, values))
+        while len(self.tailTs) > self.segmentSize:
+            self.closeSegment(self.segmentSize)
+        self.tail.setData(self.tailTs, self.tailValues)
+
+    def closeSegment(self, size: int) -> None:
+        """ Moves the first samples of the open segment to a new full segment """
+        timestamps: np.ndarray = self.tailTs[:size]
+        values: np.ndarray = self.tailValues[:size]
+        if self.bucketWidth > 0:
+            # Buckets aligned on absolute time, so that they do not depend on when the segment was closed
+            start: float = np.floor(timestamps[0] / self.bucketWidth) * self.bucketWidth
+            buckets: int = int((timestamps[-1] - start) // self.bucketWidth) + 1
+            timestamps, values = minmax_decimate(timestamps, values, start, start + buckets * self.bucketWidth, buckets)
+        segment: pg.PlotCurveItem = pg.PlotCurveItem(timestamps, values, pen=self.pen)
+        self.plot.addItem(segment)
+        self.segments.append(segment)
+        self.segmentRanges.append((float(timestamps[-1]), float(np.min(values)), float(np.max(values))))
+        # The open segment starts from the last sample of the full one, so that the curve stays connected
+        self.tailTs = self.tailTs[size - 1:]
+        self.tailValues = self.tailValues[size - 1:]
+
+    def dropBefore(self, cutoff_ts: float) -> None:
+        """ Removes the full segments that ended before the given timestamp """
+        while len(self.segments) != 0 and self.segmentRanges[0][0] < cutoff_ts:
+            self.plot.removeItem(self.segments.pop(0))
+            self.segmentRanges.pop(0)
+
+    def clear(self) -> None:
+        self.dropBefore(float("inf"))
+        self.tailTs = np.empty(0)
+        self.tailValues = np.empty(0)
+        self.tail.clear()
+
+    def yRange(self) -> Tuple[float, float]:
+        """ Returns the minimum and maximum values plotted. The curve must not be empty """
+        low: float = float(np.min(self.tailValues))
+        high: float = float(np.max(self.tailValues))
+        for _, segmentLow, segmentHigh in self.segmentRanges:
+            low = min(low, segmentLow)
+            high = max(high, segmentHigh)
+        return low, high
+
+    def setPen(self, *args, **kwargs) -> None:
+        self.pen = pg.mkPen(*args, **kwargs)
+        self.tail.setPen(self.pen)
+        for segment in self.segments:
+            segment.setPen(self.pen)
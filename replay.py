@@ -0,0 +1,224 @@
+# Offline replay of a recorded time range through the live plotting path, at 1x to 100x speed.
+# Run with: python replay.py --start "2020-06-01 12:00" --end "2020-06-01 13:00" --speed 10
+
+import argparse
+import sys
+from collections import deque
+from datetime import datetime
+from typing import List, Dict, Tuple, Deque
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtCore
+from sqlalchemy.exc import SQLAlchemyError
+
+import app
+import app_config as cfg
+import data_query as dq
+from fetch_worker import FetchBatch
+
+
+class ReplayBatch(FetchBatch):
+    """ Samples replayed up to the given clock, the timestamp the plotted window must end at """
+
+    def __init__(self, generation: int, clock: float, data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]], attacks: Dict[str, List[Tuple[float, int]]]):
+        super().__init__(generation, data, attacks)
+        self.clock: float = clock
+
+
+class ReplayChunk:
+    """ Samples and attacks of the visible sensors in [start_ts, end_ts) """
+
+    def __init__(self, start_ts: float, end_ts: float, data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]], attacks: Dict[str, List[Tuple[float, int]]]):
+        self.start_ts: float = start_ts
+        self.end_ts: float = end_ts
+        self.data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = data
+        self.attacks: Dict[str, List[Tuple[float, int]]] = attacks
+
+
+class ReplayWorker(QtCore.QObject):
+    """ Stands in for the fetch worker. Loads the recorded range in chunks, prefetched ahead of the playhead, and hands
+    the samples to the GUI thread as the playhead reaches them. Only the chunks ahead of the playhead are kept in memory.
+    The clock advances by speed * interval on each tick, regardless of the actual timer jitter, so that replays are deterministic """
+    dataReady = QtCore.pyqtSignal(object)
+
+    def __init__(self, _buffer: int, _startTs: float, _endTs: float, _speed: float, _interval: int = cfg.fetch_interval):
+        super().__init__()
+        self.buffer: int = _buffer
+        self.startTs: float = _startTs
+        self.endTs: float = _endTs
+        self.speed: float = _speed
+        self.interval: int = _interval  # Tick interval in milliseconds
+        self.generation: int = 0
+        self.visibleSensors: Dict[str, List[str]] = {}
+        self.clock: float = _startTs  # Replayed timestamp
+        self.chunks: Deque[ReplayChunk] = deque()
+        self.loadedUntil: float = _startTs  # End of the last chunk loaded
+        self.sentUntil: float = _startTs  # Samples up to this timestamp were sent
+        self.sentAny: bool = False  # Whether samples at sentUntil were sent, it is included in the first send after a (re)start
+        self.attacks: Dict[str, List[Tuple[float, int]]] = {}  # Attacks replayed in the current window
+        self.timer: QtCore.QTimer = None
+
+    @QtCore.pyqtSlot()
+    def start(self) -> None:
+        """ Starts the replay. Must be called from the worker thread """
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.interval)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start()
+
+    @QtCore.pyqtSlot()
+    def stop(self) -> None:
+        if self.timer is not None:
+            self.timer.stop()
+        dq.session.remove()
+
+    @QtCore.pyqtSlot(object)
+    def setVisibleSensors(self, visibleSensors: Dict[str, List[str]]) -> None:
+        added: bool = any(s not in self.visibleSensors.get(n, []) for n in visibleSensors.keys() for s in visibleSensors[n])
+        self.visibleSensors = visibleSensors
+        if added:
+            # The chunks loaded so far do not hold the new sensors
+            self.rewind()
+
+    @QtCore.pyqtSlot(str, str)
+    def releaseSensor(self, node: str, sensor: str) -> None:
+        pass  # The window is replayed again once the sensor is visible again
+
+    @QtCore.pyqtSlot(int)
+    def setResolution(self, buckets: int) -> None:
+        pass  # Replays are not decimated by the database
+
+    @QtCore.pyqtSlot(int, int)
+    def setBuffer(self, buffer: int, generation: int) -> None:
+        """ Changes the duration of the window. A new generation means the GUI dropped its data, so the whole window is loaded again """
+        self.buffer = buffer
+        if generation != self.generation:
+            self.generation = generation
+            self.rewind()
+
+    @QtCore.pyqtSlot(float)
+    def setSpeed(self, speed: float) -> None:
+        self.speed = speed
+
+    def rewind(self) -> None:
+        """ Drops the loaded chunks and loads the window before the playhead again """
+        self.chunks.clear()
+        self.attacks.clear()
+        self.loadedUntil = max(self.clock - self.buffer, self.startTs)
+        self.sentUntil = self.loadedUntil
+        self.sentAny = False
+
+    @QtCore.pyqtSlot()
+    def tick(self) -> None:
+        """ Advances the playhead and sends the samples it went over """
+        visibleNodes: List[str] = [n for n in self.visibleSensors.keys() if len(self.visibleSensors[n]) != 0]
+        try:
+            self.clock = min(self.clock + self.speed * self.interval / 1000., self.endTs)
+            if len(visibleNodes) == 0:
+                self.rewind()
+                return
+            while self.loadedUntil < self.clock:
+                self.loadChunk(visibleNodes)
+            self.sendUntil(self.clock)
+            # Prefetch at most one chunk per tick, to keep the ticks regular
+            if self.loadedUntil < min(self.clock + cfg.replay_prefetch, self.endTs):
+                self.loadChunk(visibleNodes)
+            if self.clock >= self.endTs:
+                print("Replay finished", file=sys.stderr)
+                self.timer.stop()
+        except SQLAlchemyError as e:
+            print("Replay fetch failed: %s" % e, file=sys.stderr)
+            dq.session.rollback()
+        finally:
+            dq.session.close()
+
+    def loadChunk(self, visibleNodes: List[str]) -> None:
+        end_ts: float = min(self.loadedUntil + cfg.replay_chunk, self.endTs)
+        data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = dq.get_data_arrays_between_ts_all_nodes(
+            visibleNodes, self.visibleSensors, self.loadedUntil, end_ts)
+        attacks: Dict[str, List[Tuple[float, int]]] = dq.get_attacks_between_ts_all_nodes(
+            visibleNodes, self.loadedUntil, end_ts)
+        self.chunks.append(ReplayChunk(self.loadedUntil, end_ts, data, attacks))
+        self.loadedUntil = end_ts
+
+    def sendUntil(self, clock: float) -> None:
+        """ Sends the samples in (sentUntil, clock], or [sentUntil, clock] on the first send of the loaded range,
+        then drops the chunks entirely replayed """
+        side: str = "right" if self.sentAny else "left"
+        data: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+        for chunk in self.chunks:
+            if chunk.start_ts > clock:
+                break
+            for node in chunk.data.keys():
+                for sensor, (timestamps, values) in chunk.data[node].items():
+                    first: int = int(np.searchsorted(timestamps, self.sentUntil, side=side))
+                    last: int = int(np.searchsorted(timestamps, clock, side="right"))
+                    if last > first:
+                        data.setdefault(node, {})[sensor] = (timestamps[first:last], values[first:last])
+            for node, attacks in chunk.attacks.items():
+                self.attacks.setdefault(node, []).extend(
+                    a for a in attacks if (self.sentUntil < a[0] or not self.sentAny and self.sentUntil == a[0]) and a[0] <= clock)
+        while len(self.chunks) != 0 and self.chunks[0].end_ts <= clock:
+            self.chunks.popleft()
+        self.sentUntil = clock
+        self.sentAny = True
+        # Only the attacks still in the window are kept and sent
+        for node in self.attacks.keys():
+            self.attacks[node] = [a for a in self.attacks[node] if a[0] >= clock - self.buffer]
+        self.dataReady.emit(ReplayBatch(self.generation, clock, data, dict(self.attacks)))
+
+
+class ReplayWindow(app.PlotsWindow):
+    """ Plots window fed by a replay worker, with the window ending at the replayed clock instead of the current time """
+
+    def __init__(self, _startTs: float, _endTs: float, _speed: float):
+        self.startTs: float = _startTs
+        self.endTs: float = _endTs
+        self.speed: float = _speed
+        self.clock: float = _startTs
+        super().__init__()
+        self.setWindowTitle("Replay %s - %s (x%g)" % (datetime.fromtimestamp(_startTs), datetime.fromtimestamp(_endTs), _speed))
+
+    def createWorker(self) -> ReplayWorker:
+        return ReplayWorker(self.buffer, self.startTs, self.endTs, self.speed)
+
+    def now(self) -> float:
+        return self.clock
+
+    def storeBatch(self, batch: ReplayBatch) -> None:
+        super().storeBatch(batch)
+        if batch.clock != self.clock:
+            self.clock = batch.clock
+            self.scheduler.markDirty()
+
+
+def parse_timestamp(value: str) -> float:
+    """ Parses an epoch timestamp or an ISO 8601 local date and time """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replays a recorded time range")
+    parser.add_argument("--start", type=parse_timestamp, required=True, help="epoch timestamp, or local date and time")
+    parser.add_argument("--end", type=parse_timestamp, required=True, help="epoch timestamp, or local date and time")
+    parser.add_argument("--speed", type=float, default=1., help="playback speed, from 1 to %g" % cfg.replay_max_speed)
+    args = parser.parse_args()
+    if args.end <= args.start:
+        parser.error("--end must be after --start")
+    if not 1. <= args.speed <= cfg.replay_max_speed:
+        parser.error("--speed must be between 1 and %g" % cfg.replay_max_speed)
+    pg.setConfigOptions(background=cfg.themes["light"]["background"],
+                        foreground=cfg.themes["light"]["axis"])
+    qapp = pg.QtGui.QApplication(sys.argv)
+    qapp.setApplicationName("Plotter - Replay")
+    plots_win: ReplayWindow = ReplayWindow(args.start, args.end, args.speed)
+    sett_win: app.SettingsWindow = app.SettingsWindow(plots_win)
+    sys.exit(qapp.exec_())
+
+
+if __name__ == "__main__":
+    main()
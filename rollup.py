@@ -0,0 +1,159 @@
+# Maintains pre-aggregated min/max/sum/count rollups of the measurements at several resolutions.
+# Run alongside the data producer to keep them up to date: python rollup.py
+
+import time
+from typing import List, Dict
+
+from sqlalchemy import MetaData, Table, Column, Index, Integer, Float, select, func, cast, inspect
+from sqlalchemy.engine import Engine
+
+from bookkeeper.sql import Measurement
+
+import app_config as cfg
+import db
+
+rollup_metadata: MetaData = MetaData()
+
+rollup_tables: Dict[int, Table] = {
+    resolution: Table(
+        "measurement_rollup_%ds" % resolution, rollup_metadata,
+        Column("sensor_id", Integer, primary_key=True),
+        Column("bucket", Float, primary_key=True),  # Start timestamp of the bucket
+        Column("node_id", Integer, nullable=False),
+        Column("min", Float, nullable=False),
+        Column("max", Float, nullable=False),
+        Column("sum", Float, nullable=False),
+        Column("count", Integer, nullable=False))
+    for resolution in cfg.rollup_resolutions}
+
+# Rollups are complete for all the buckets before the watermark of their resolution
+rollup_state: Table = Table(
+    "measurement_rollup_state", rollup_metadata,
+    Column("resolution", Integer, primary_key=True),
+    Column("watermark", Float, nullable=False))
+
+# The slices of the finest resolution are selected by timestamp alone, across all the sensors
+TIMESTAMP_INDEX: str = "plotter_measurement_ts"
+
+
+def floor_expr(expr, dialect: str):
+    """Returns a SQL expression rounding the given positive expression down"""
+    if dialect == "sqlite":
+        return cast(expr, Integer)  # No FLOOR in SQLite, truncating is the same for positive values
+    return func.floor(expr)
+
+
+def create_tables(engine: Engine) -> None:
+    rollup_metadata.create_all(engine)
+    create_timestamp_index(engine)
+
+
+def create_timestamp_index(engine: Engine) -> None:
+    """Creates an index on the measurement timestamps, unless an index already starts with them"""
+    table: Table = Measurement.__table__
+    if any(index["column_names"][:1] == [table.c.timestamp.name] for index in inspect(engine).get_indexes(table.name)):
+        return
+    print("Creating the index %s, this may take a while on a large table" % TIMESTAMP_INDEX)
+    if engine.dialect.name == "postgresql":
+        # Without locking the table against the inserts of the producer
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS "%s" ON "%s" ("%s")' % (
+                TIMESTAMP_INDEX, table.name, table.c.timestamp.name))
+    else:
+        Index(TIMESTAMP_INDEX, table.c.timestamp).create(engine)
+
+
+def tables_exist(engine: Engine) -> bool:
+    return engine.has_table(rollup_state.name)
+
+
+def get_watermarks(session) -> Dict[int, float]:
+    """Returns the watermark of each resolution that has already been rolled up"""
+    rows: list = session.execute(select([rollup_state.c.resolution, rollup_state.c.watermark])).fetchall()
+    return {r.resolution: r.watermark for r in rows}
+
+
+def choose_resolution(window: float, points: int, watermarks: Dict[int, float]) -> int:
+    """Returns the coarsest available resolution that still gives the requested number of points over the window, or 0 if none does"""
+    candidates: List[int] = [r for r in watermarks.keys() if r in rollup_tables and window / r >= points]
+    if len(candidates) == 0:
+        return 0
+    return max(candidates)
+
+
+def slice_query(previous: Table, resolution: int, start_ts: float, end_ts: float, dialect: str):
+    """Returns the query aggregating the buckets of the given resolution in [start_ts, end_ts),
+    from the previous (finer) rollup table, or from the raw measurements if it is None"""
+    if previous is None:
+        source_ts = Measurement.timestamp
+        source_cols: list = [Measurement.sensor_id, Measurement.node_id,
+                             func.min(Measurement.value), func.max(Measurement.value),
+                             func.sum(Measurement.value), func.count(Measurement.value)]
+    else:
+        source_ts = previous.c.bucket
+        source_cols = [previous.c.sensor_id, previous.c.node_id,
+                       func.min(previous.c.min), func.max(previous.c.max),
+                       func.sum(previous.c.sum), func.sum(previous.c.count)]
+    bucket = (floor_expr(source_ts / resolution, dialect) * resolution).label("bucket")
+    return select([bucket] + source_cols).\
+        where(source_ts >= start_ts).\
+        where(source_ts < end_ts).\
+        group_by(source_cols[0], source_cols[1], bucket)
+
+
+def update_rollups(session, now: float = None) -> Dict[int, int]:
+    """Aggregates all the closed buckets after the watermark of each resolution.
+    Each resolution is built from the previous (finer) one, the first one from the raw measurements.
+    Returns the number of buckets added per resolution"""
+    if now is None:
+        now = time.time()
+    dialect: str = session.get_bind().dialect.name
+    watermarks: Dict[int, float] = get_watermarks(session)
+    added: Dict[int, int] = {}
+    # Samples arriving up to rollup_lag seconds late are still accounted for
+    source_end: float = now - cfg.rollup_lag
+    previous: Table = None
+    for resolution in sorted(rollup_tables.keys()):
+        table: Table = rollup_tables[resolution]
+        if resolution in watermarks:
+            start: float = watermarks[resolution]
+        else:
+            # Only looked up before the first slice, the watermark is stored from then on
+            source_ts = Measurement.timestamp if previous is None else previous.c.bucket
+            first_ts = session.query(func.min(source_ts)).scalar()
+            if first_ts is None:
+                break  # Nothing to aggregate yet
+            start = (first_ts // resolution) * resolution
+        end: float = (source_end // resolution) * resolution
+        # Aggregated in bounded slices, each committed with its watermark, so that a backfill of the whole history
+        # never runs as a single huge query and resumes where it stopped
+        step: float = max((cfg.rollup_slice // resolution) * resolution, resolution)
+        slice_start: float = start
+        while end > slice_start:
+            slice_end: float = min(slice_start + step, end)
+            query = slice_query(previous, resolution, slice_start, slice_end, dialect)
+            result = session.execute(table.insert().from_select(
+                ["bucket", "sensor_id", "node_id", "min", "max", "sum", "count"], query))
+            if resolution in watermarks:
+                session.execute(rollup_state.update().
+                                where(rollup_state.c.resolution == resolution).
+                                values(watermark=slice_end))
+            else:
+                session.execute(rollup_state.insert().values(resolution=resolution, watermark=slice_end))
+                watermarks[resolution] = slice_end
+            session.commit()
+            added[resolution] = added.get(resolution, 0) + result.rowcount
+            slice_start = slice_end
+        # Coarser resolutions can only use the buckets already rolled up at this one
+        source_end = max(end, start)
+        previous = table
+    return added
+
+
+if __name__ == "__main__":
+    create_tables(db.engine)
+    while True:
+        added: Dict[int, int] = update_rollups(db.session)
+        for resolution, count in added.items():
+            print("Added %d buckets at %ds resolution" % (count, resolution))
+        time.sleep(cfg.rollup_interval)
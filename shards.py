@@ -0,0 +1,187 @@
+# Multi-process rendering: the nodes are split across several plotting processes, each with its own window,
+# fetch worker and GIL, driven by a single settings window in the coordinator process.
+# Run with: python shards.py --processes 4
+
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+from multiprocessing.connection import Connection
+from typing import List, Dict, Set, Tuple
+
+import pyqtgraph as pg
+from PyQt5 import QtCore
+
+import app
+import app_config as cfg
+import data_query as dq
+
+
+def assign_nodes(sensors: Dict[str, List[str]], processes: int) -> List[List[str]]:
+    """ Splits the nodes into groups with about as many sensors each, largest nodes first """
+    shards: List[List[str]] = [[] for _ in range(processes)]
+    loads: List[int] = [0] * processes
+    for node in sorted(sensors.keys(), key=lambda n: len(sensors[n]), reverse=True):
+        shard: int = loads.index(min(loads))
+        shards[shard].append(node)
+        loads[shard] += len(sensors[node])
+    return [sorted(nodes) for nodes in shards if len(nodes) != 0]
+
+
+def run_shard(index: int, count: int, nodes: List[str], connection: Connection) -> None:
+    """ Entry point of a plotting process. Applies the commands received from the coordinator and reports the render statistics """
+    if cfg.cache_dir:
+        # Each process accounts for and evicts its own cached files, so they do not share a directory
+        cfg.cache_dir = os.path.join(cfg.cache_dir, "shard_%d_of_%d" % (index + 1, count))
+        cfg.cache_max_size //= count
+    pg.setConfigOptions(background=cfg.themes["light"]["background"],
+                        foreground=cfg.themes["light"]["axis"])
+    qapp = pg.QtGui.QApplication(sys.argv)
+    qapp.setApplicationName("Plotter - shard %d/%d" % (index + 1, count))
+    window = app.PlotsWindow(_nodes=nodes)
+    window.setWindowTitle("Plots %d/%d" % (index + 1, count))
+    window.scheduler.statsUpdated.connect(lambda fps, frameTime, budget: connection.send(("stats", index, fps, frameTime, budget)))
+
+    # Commands received before the shard discovered its nodes, applied in order once it did
+    pending: List[tuple] = []
+
+    def receiveCommands() -> None:
+        while connection.poll():
+            command: tuple = connection.recv()
+            if command[0] == "quit":
+                qapp.quit()
+                return
+            pending.append(command)
+        applyCommands()
+
+    def applyCommands() -> None:
+        if not window.discovered:
+            return  # The plots cannot be created before the sensors of the nodes are known
+        while len(pending) != 0:
+            command: tuple = pending.pop(0)
+            getattr(window, command[0])(*command[1:])
+
+    window.nodesLoaded.connect(applyCommands)
+
+    timer: QtCore.QTimer = QtCore.QTimer()
+    timer.setInterval(cfg.shard_command_interval)
+    timer.timeout.connect(receiveCommands)
+    timer.start()
+    qapp.exec_()
+
+
+class ShardStats(QtCore.QObject):
+    """ Render statistics of all the plotting processes, in the format of the frame scheduler of a PlotsWindow """
+    statsUpdated = QtCore.pyqtSignal(float, float, float)  # Total FPS, worst mean frame time (ms), frame budget (ms)
+
+
+class ShardCoordinator(QtCore.QObject):
+    """ Stands in for a PlotsWindow in the settings window, and forwards each change to the process plotting the node """
+    nodesLoaded = QtCore.pyqtSignal()  # Never emitted, the nodes are loaded before the settings window is created
+
+    def __init__(self, _processes: int):
+        super().__init__()
+        self.buffer: int = 60  # Buffer in seconds
+        self.maxBuffer: int = cfg.max_buffer  # Buffer in seconds
+        self.anomalyBands: bool = cfg.anomaly_bands
+        sensors: Dict[str, List[str]] = dq.get_nodes_and_sensors()
+        self.nodes: List[str] = sorted(sensors.keys())
+        self.sensors: Dict[str, List[str]] = {node: sorted(sensors[node]) for node in self.nodes}
+        self.discovered: bool = True
+        self.shownPlots: Set[Tuple[str, str]] = set()
+        self.shardStats: Dict[int, Tuple[float, float, float]] = {}
+        self.scheduler: ShardStats = ShardStats()
+        self.shardOf: Dict[str, int] = {}
+        self.connections: List[Connection] = []
+        self.processes: List[mp.Process] = []
+        shards: List[List[str]] = assign_nodes(self.sensors, _processes)
+        # Qt does not survive a fork, each process starts a fresh interpreter
+        context = mp.get_context("spawn")
+        for index, nodes in enumerate(shards):
+            connection, shardConnection = context.Pipe()
+            process = context.Process(target=run_shard, args=(index, len(shards), nodes, shardConnection), daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+            for node in nodes:
+                self.shardOf[node] = index
+        self.timer: QtCore.QTimer = QtCore.QTimer()
+        self.timer.setInterval(cfg.shard_command_interval)
+        self.timer.timeout.connect(self.receiveStats)
+        self.timer.start()
+
+    def send(self, shard: int, *command) -> None:
+        if self.processes[shard].is_alive():
+            self.connections[shard].send(command)
+
+    def broadcast(self, *command) -> None:
+        for shard in range(len(self.connections)):
+            self.send(shard, *command)
+
+    def receiveStats(self) -> None:
+        """ Collects the latest render statistics of each process """
+        received: bool = False
+        for connection in self.connections:
+            while connection.poll():
+                _, shard, fps, frameTime, budget = connection.recv()
+                self.shardStats[shard] = (fps, frameTime, budget)
+                received = True
+        if received:
+            self.scheduler.statsUpdated.emit(sum(s[0] for s in self.shardStats.values()),
+                                             max(s[1] for s in self.shardStats.values()),
+                                             min(s[2] for s in self.shardStats.values()))
+
+    def stop(self) -> None:
+        """ Asks all the plotting processes to quit, and waits for them """
+        self.broadcast("quit")
+        deadline: float = time.time() + 5.
+        for process in self.processes:
+            process.join(max(deadline - time.time(), 0.))
+            if process.is_alive():
+                process.terminate()
+
+    def setBuffer(self, buffer: int) -> None:
+        self.buffer = buffer
+        self.broadcast("setBuffer", buffer)
+
+    def updateTheme(self, theme: str) -> None:
+        self.broadcast("updateTheme", theme)
+
+    def setAnomalyBands(self, enabled: bool) -> None:
+        self.anomalyBands = enabled
+        self.broadcast("setAnomalyBands", enabled)
+
+    def showNode(self, node: str) -> None:
+        self.send(self.shardOf[node], "showNode", node)
+
+    def hideNode(self, node: str) -> None:
+        self.send(self.shardOf[node], "hideNode", node)
+
+    def isPlotShown(self, node: str, sensor: str) -> bool:
+        return (node, sensor) in self.shownPlots
+
+    def showPlot(self, node: str, sensor: str) -> None:
+        self.shownPlots.add((node, sensor))
+        self.send(self.shardOf[node], "showPlot", node, sensor)
+
+    def hidePlot(self, node: str, sensor: str) -> None:
+        self.shownPlots.discard((node, sensor))
+        self.send(self.shardOf[node], "hidePlot", node, sensor)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Plots the nodes from several processes")
+    parser.add_argument("--processes", type=int, default=cfg.render_processes or mp.cpu_count(),
+                        help="number of plotting processes")
+    args = parser.parse_args()
+    qapp = pg.QtGui.QApplication(sys.argv)
+    qapp.setApplicationName("Plotter")
+    coordinator: ShardCoordinator = ShardCoordinator(args.processes)
+    qapp.aboutToQuit.connect(coordinator.stop)
+    sett_win: app.SettingsWindow = app.SettingsWindow(coordinator)
+    sys.exit(qapp.exec_())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import math
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+class RingBuffer:
+    """ Fixed-capacity buffer of timestamp/value samples backed by NumPy arrays.
+
+    The samples are kept in a contiguous slice of arrays twice as large as the capacity,
+    so the current content is always available as a view without copying. The slice is
+    moved back to the front of the arrays when it reaches their end (amortized O(1)).
+
+    With track_stats, the cumulative sums of the values and of their squares are kept alongside,
+    so that the mean and standard deviation of the content are available in O(1) whatever samples were dropped. """
+
+    def __init__(self, capacity: int, track_stats: bool = False):
+        self.capacity: int = capacity
+        self._timestamps: np.ndarray = np.empty(2 * capacity, dtype=np.float64)
+        self._values: np.ndarray = np.empty(2 * capacity, dtype=np.float64)
+        self._start: int = 0
+        self._end: int = 0
+        self.track_stats: bool = False
+        self.set_track_stats(track_stats)
+
+    def set_track_stats(self, enabled: bool) -> None:
+        """ Starts or stops keeping the cumulative sums. They are computed over the current content when started """
+        if enabled == self.track_stats:
+            return
+        self.track_stats = enabled
+        if not enabled:
+            del self._sums, self._squares, self._offset
+            return
+        # _sums[i] is the sum of the values before index i, shifted by _offset to limit the rounding errors
+        self._sums: np.ndarray = np.zeros(2 * self.capacity + 1, dtype=np.float64)
+        self._squares: np.ndarray = np.zeros(2 * self.capacity + 1, dtype=np.float64)
+        self._offset: float = float(self._values[self._start]) if len(self) != 0 else 0.
+        self._accumulate(self._start, self.values)
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """ View on the timestamps currently held, oldest first """
+        return self._timestamps[self._start:self._end]
+
+    @property
+    def values(self) -> np.ndarray:
+        """ View on the values currently held, oldest first """
+        return self._values[self._start:self._end]
+
+    @property
+    def last_ts(self) -> float:
+        """ Timestamp of the newest sample, or -inf if the buffer is empty """
+        if self._end == self._start:
+            return float("-inf")
+        return float(self._timestamps[self._end - 1])
+
+    def append(self, timestamps: np.ndarray, values: np.ndarray) -> int:
+        """ Appends samples sorted by timestamp, dropping the oldest ones if the buffer is full.
+        Samples that are not newer than the last one held are ignored. Returns the number of samples added """
+        if len(self) != 0:
+            newer: np.ndarray = timestamps > self.last_ts
+            timestamps = timestamps[newer]
+            values = values[newer]
+        count: int = len(timestamps)
+        if count == 0:
+            return 0
+        if self.track_stats and len(self) == 0:
+            self._offset = float(values[0])  # No sum in use, the offset can change
+        if count >= self.capacity:
+            self._timestamps[:self.capacity] = timestamps[-self.capacity:]
+            self._values[:self.capacity] = values[-self.capacity:]
+            self._start = 0
+            self._end = self.capacity
+            if self.track_stats:
+                self._accumulate(0, self._values[:self.capacity])
+            return count
+        # Drop the oldest samples to make room for the new ones
+        self._start = max(self._start, self._end + count - self.capacity)
+        if self._end + count > len(self._timestamps):
+            # Move the current content back to the front of the arrays
+            size: int = len(self)
+            self._timestamps[:size] = self._timestamps[self._start:self._end]
+            self._values[:size] = self._values[self._start:self._end]
+            if self.track_stats:
+                # Rebased on the first sample kept, so that the sums do not grow forever
+                self._sums[:size + 1] = self._sums[self._start:self._end + 1] - self._sums[self._start]
+                self._squares[:size + 1] = self._squares[self._start:self._end + 1] - self._squares[self._start]
+            self._start = 0
+            self._end = size
+        self._timestamps[self._end:self._end + count] = timestamps
+        self._values[self._end:self._end + count] = values
+        if self.track_stats:
+            self._accumulate(self._end, self._values[self._end:self._end + count])
+        self._end += count
+        return count
+
+    def _accumulate(self, index: int, values: np.ndarray) -> None:
+        """ Extends the cumulative sums with the values written from the given index """
+        shifted: np.ndarray = values - self._offset
+        self._sums[index + 1:index + 1 + len(values)] = self._sums[index] + np.cumsum(shifted)
+        self._squares[index + 1:index + 1 + len(values)] = self._squares[index] + np.cumsum(shifted * shifted)
+
+    def mean_std(self) -> Tuple[float, float]:
+        """ Returns the mean and the standard deviation of the values currently held, in O(1). Requires track_stats """
+        count: int = len(self)
+        if count == 0:
+            return float("nan"), float("nan")
+        total: float = self._sums[self._end] - self._sums[self._start]
+        squares: float = self._squares[self._end] - self._squares[self._start]
+        mean: float = total / count
+        return self._offset + mean, math.sqrt(max(squares / count - mean * mean, 0.))
+
+    def drop_before(self, cutoff_ts: float) -> None:
+        """ Drops all the samples older than the given timestamp """
+        self._start += int(np.searchsorted(self.timestamps, cutoff_ts, side="left"))
+
+    def clear(self) -> None:
+        self._start = 0
+        self._end = 0
+
+
+class TimeSeriesStore:
+    """ Client-side store of the recent samples of each node/sensor, one ring buffer per sensor """
+
+    def __init__(self, capacity: int, track_stats: bool = False):
+        self.capacity: int = capacity
+        self.track_stats: bool = track_stats
+        self.buffers: Dict[Tuple[str, str], RingBuffer] = {}
+
+    def get(self, node: str, sensor: str) -> RingBuffer:
+        """ Returns the buffer of the given node/sensor, creating it on first use """
+        key: Tuple[str, str] = (node, sensor)
+        if key not in self.buffers:
+            self.buffers[key] = RingBuffer(self.capacity, self.track_stats)
+        return self.buffers[key]
+
+    def set_track_stats(self, enabled: bool) -> None:
+        """ Starts or stops keeping the statistics of all the buffers, current and future """
+        self.track_stats = enabled
+        for buffer in self.buffers.values():
+            buffer.set_track_stats(enabled)
+
+    def last_ts(self, node: str, sensor: str) -> float:
+        """ Returns the timestamp of the newest sample held for the given node/sensor """
+        if (node, sensor) not in self.buffers:
+            return float("-inf")
+        return self.buffers[(node, sensor)].last_ts
+
+    def append(self, node: str, sensor: str, timestamps: np.ndarray, values: np.ndarray) -> int:
+        return self.get(node, sensor).append(timestamps, values)
+
+    def remove(self, node: str, sensor: str) -> None:
+        """ Frees the buffer of the given node/sensor """
+        self.buffers.pop((node, sensor), None)
+
+    def drop_before(self, cutoff_ts: float) -> None:
+        """ Drops the samples older than the given timestamp from all buffers """
+        for buffer in self.buffers.values():
+            buffer.drop_before(cutoff_ts)
+
+    def clear(self) -> None:
+        for buffer in self.buffers.values():
+            buffer.clear()
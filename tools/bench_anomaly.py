@@ -0,0 +1,77 @@
+# Benchmarks the per-tick overhead of the anomaly bands against the frame budget.
+# Each tick appends the samples of one fetch interval to every sensor, then updates its band and classifies the new samples.
+# Run from the repository root: python tools/bench_anomaly.py
+
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import app_config as cfg  # noqa: E402
+from anomaly import AnomalyTracker  # noqa: E402
+from timeseries import RingBuffer  # noqa: E402
+
+SENSOR_COUNTS: List[int] = [12, 48, 96]
+WINDOW: int = cfg.raw_window  # Plotted window (s), the longest one buffered as raw samples
+TICKS: int = 200
+
+
+def recompute(buffer: RingBuffer, k: float, last_ts: float) -> np.ndarray:
+    """ Naive version: statistics recomputed over the whole window on every tick. Returns the new outliers """
+    mean: float = float(np.mean(buffer.values))
+    std: float = float(np.std(buffer.values))
+    first: int = int(np.searchsorted(buffer.timestamps, last_ts, side="right"))
+    values: np.ndarray = buffer.values[first:]
+    return values[(values < mean - k * std) | (values > mean + k * std)]
+
+
+def run(sensors: int, mode: str) -> float:
+    """ Returns the mean time of a tick (ms), with a full window in every buffer.
+    The mode is "none" without bands, "incremental" with the anomaly trackers, or "recompute" """
+    track_stats: bool = mode == "incremental"
+    rng: np.random.RandomState = np.random.RandomState(0)
+    capacity: int = WINDOW * cfg.max_sample_rate
+    per_tick: int = int(cfg.max_sample_rate * cfg.fetch_interval / 1000)
+    buffers: List[RingBuffer] = [RingBuffer(capacity, track_stats) for _ in range(sensors)]
+    trackers: List[AnomalyTracker] = [AnomalyTracker() for _ in range(sensors)]
+    timestamps: np.ndarray = np.arange(capacity) / cfg.max_sample_rate
+    for buffer in buffers:
+        buffer.append(timestamps, rng.normal(50., 5., capacity))
+    now: float = timestamps[-1]
+    if mode == "incremental":
+        for buffer, tracker in zip(buffers, trackers):
+            tracker.update(buffer)
+    start: float = time.perf_counter()
+    for _ in range(TICKS):
+        new_ts: np.ndarray = now + (np.arange(per_tick) + 1) / cfg.max_sample_rate
+        now = new_ts[-1]
+        for buffer, tracker in zip(buffers, trackers):
+            last_ts: float = buffer.last_ts
+            buffer.append(new_ts, rng.normal(50., 5., per_tick))
+            buffer.drop_before(now - WINDOW)
+            if mode == "incremental":
+                tracker.update(buffer)
+                tracker.drop_before(now - WINDOW)
+            elif mode == "recompute":
+                recompute(buffer, cfg.anomaly_k, last_ts)
+    return (time.perf_counter() - start) / TICKS * 1000.
+
+
+if __name__ == "__main__":
+    budget: float = 1000. / cfg.target_fps
+    print("%d s window at %d Hz, %d samples per sensor and tick, frame budget %.1f ms" %
+          (WINDOW, cfg.max_sample_rate, int(cfg.max_sample_rate * cfg.fetch_interval / 1000), budget))
+    print("%8s %14s %14s %14s %14s" % ("sensors", "base ms/tick", "bands ms/tick", "% of budget", "recompute ms"))
+    results: Dict[int, float] = {}
+    for sensors in SENSOR_COUNTS:
+        base: float = run(sensors, "none")
+        bands: float = run(sensors, "incremental")
+        naive: float = run(sensors, "recompute")
+        results[sensors] = bands - base
+        # The overhead and recompute columns exclude the base cost of appending the samples
+        print("%8d %14.3f %14.3f %14.1f %14.3f" % (sensors, base, bands, (bands - base) / budget * 100., naive - base))
+    worst: int = SENSOR_COUNTS[-1]
+    print("Overhead with %d sensors: %.3f ms, %.1f%% of the frame budget" % (worst, results[worst], results[worst] / budget * 100.))
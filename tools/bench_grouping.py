@@ -0,0 +1,90 @@
+# Benchmarks the grouping of the batch queries result rows by sensor.
+# Exits with status 1 if the cost per row of either grouping grows with the number of sensors by more than MAX_RATIO.
+# Run from the repository root: python tools/bench_grouping.py
+
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from columnar import group_rows, split_sorted_columns  # noqa: E402
+
+SENSOR_COUNTS: List[int] = [1, 10, 100]
+ROW_COUNTS: List[int] = [1000, 100000, 10000000]  # Total rows, the largest one is 100k rows for each of 100 sensors
+# Python tuples take about 100 bytes per row, larger result sets are only benchmarked as NumPy columns
+MAX_TUPLE_ROWS: int = 1000000
+REPEATS: int = 5
+# Highest accepted per-row cost ratio between the largest and smallest number of sensors, above timing noise
+MAX_RATIO: float = 1.5
+
+
+def make_columns(sensors: int, rows: int) -> np.ndarray:
+    """ Returns the timestamp, value and sensor ID columns of rows sorted by sensor ID then timestamp, as returned by the batch queries """
+    per_sensor: int = rows // sensors
+    columns: np.ndarray = np.empty((per_sensor * sensors, 3), dtype=np.float64)
+    columns[:, 0] = np.tile(np.arange(per_sensor, dtype=np.float64), sensors)
+    columns[:, 1] = columns[:, 0] % 7
+    columns[:, 2] = np.repeat(np.arange(1, sensors + 1, dtype=np.float64), per_sensor)
+    return columns
+
+
+def make_rows(columns: np.ndarray) -> List[Tuple[float, float, int]]:
+    """ Returns the same rows as tuples """
+    return list(zip(columns[:, 0].tolist(), columns[:, 1].tolist(), columns[:, 2].astype(np.int64).tolist()))
+
+
+def legacy_group_rows(rows: List[Tuple[float, float, int]], keys: List[int]) -> Dict[int, List[Tuple[float, float]]]:
+    """ Former implementation: one scan of the result set per sensor, then a sort """
+    groups: Dict[int, List[Tuple[float, float]]] = {}
+    for key in keys:
+        tmp: List[Tuple[float, float]] = [(r[0], r[1]) for r in rows if r[2] == key]
+        tmp.sort(key=lambda e: e[0])
+        groups[key] = tmp
+    return groups
+
+
+def best_time(func: Callable, *args) -> float:
+    times: List[float] = []
+    for _ in range(REPEATS):
+        start: float = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def check_ratio(name: str, per_row: Dict[Tuple[int, int], float], rows: int) -> bool:
+    """ Checks that the cost per row does not grow with the number of sensors """
+    ratio: float = per_row[(SENSOR_COUNTS[-1], rows)] / per_row[(SENSOR_COUNTS[0], rows)]
+    print("%s: per-row cost ratio %d vs %d sensors at %d rows: %.2f (max %.2f)" %
+          (name, SENSOR_COUNTS[-1], SENSOR_COUNTS[0], rows, ratio, MAX_RATIO))
+    return ratio <= MAX_RATIO
+
+
+if __name__ == "__main__":
+    print("%8s %8s %14s %14s %14s" % ("sensors", "rows", "tuples ns/row", "arrays ns/row", "legacy ns/row"))
+    tuples_per_row: Dict[Tuple[int, int], float] = {}
+    arrays_per_row: Dict[Tuple[int, int], float] = {}
+    for sensors in SENSOR_COUNTS:
+        for rows in ROW_COUNTS:
+            keys: List[int] = list(range(1, sensors + 1))
+            columns: np.ndarray = make_columns(sensors, rows)
+            arrays_per_row[(sensors, rows)] = best_time(split_sorted_columns, columns, keys) / len(columns)
+            tuples: str = "-"
+            legacy: str = "-"
+            if rows <= MAX_TUPLE_ROWS:
+                rows_list: List[Tuple[float, float, int]] = make_rows(columns)
+                tuples_per_row[(sensors, rows)] = best_time(group_rows, rows_list, keys) / len(rows_list)
+                tuples = "%14.1f" % (tuples_per_row[(sensors, rows)] * 1e9)
+                if sensors * rows <= 1000000:  # The legacy version is too slow beyond that
+                    legacy = "%14.1f" % (best_time(legacy_group_rows, rows_list, keys) / len(rows_list) * 1e9)
+                del rows_list
+            print("%8d %8d %14s %14.1f %14s" % (sensors, len(columns), tuples, arrays_per_row[(sensors, rows)] * 1e9, legacy))
+            del columns
+    tuples_ok: bool = check_ratio("group_rows", tuples_per_row, max(r for r in ROW_COUNTS if r <= MAX_TUPLE_ROWS))
+    arrays_ok: bool = check_ratio("split_sorted_columns", arrays_per_row, ROW_COUNTS[-1])
+    if not (tuples_ok and arrays_ok):
+        print("The grouping does not scale linearly")
+        sys.exit(1)
@@ -0,0 +1,169 @@
+# Reproducible benchmark of the query + render pipeline.
+# Seeds a database with synthetic data, drives PlotsWindow offscreen and prints JSON timings.
+# Run from the repository root: python tools/benchmark.py --nodes 4 --sensors 6 --rate 10 --window 60
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import List, Dict
+
+import numpy as np
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app_config as cfg  # noqa: E402
+from bookkeeper.sql import create_sessions, Node, Sensor, Measurement, Attack  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks the plotter query and render pipeline")
+    parser.add_argument("--db", default="sqlite:///" + os.path.join(tempfile.gettempdir(), "plotter_bench.sqlite"),
+                        help="database URL, an SQLite file is recreated on each run")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--sensors", type=int, default=6, help="sensors per node")
+    parser.add_argument("--rate", type=float, default=10., help="samples per second and per sensor")
+    parser.add_argument("--window", type=int, default=60, help="plotted window (s)")
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--tick-interval", type=float, default=0.2, help="simulated time between two ticks (s)")
+    parser.add_argument("--attack-period", type=float, default=10., help="seconds between two attacks on a node")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args()
+
+
+def seed(session, args: argparse.Namespace, start_ts: float, end_ts: float) -> Dict[int, int]:
+    """ Creates the nodes/sensors and fills the window before end_ts. Returns the node ID of each sensor ID """
+    rng = np.random.RandomState(args.seed)
+    sensor_nodes: Dict[int, int] = {}
+    for n in range(args.nodes):
+        node = Node(name="bench_node_%d" % n)
+        session.add(node)
+        session.flush()
+        for s in range(args.sensors):
+            sensor = Sensor(name="sensor_%d" % s, unit="N/A", average=0, std=1, node_id=node.id)
+            session.add(sensor)
+            session.flush()
+            sensor_nodes[sensor.id] = node.id
+    session.commit()
+    insert_samples(session, sensor_nodes, start_ts, end_ts, args.rate, rng)
+    attacks: List[dict] = [{"timestamp": ts, "attack_type": 0, "node_id": node_id}
+                           for node_id in set(sensor_nodes.values())
+                           for ts in np.arange(start_ts, end_ts, args.attack_period)]
+    if len(attacks) != 0:
+        session.execute(Attack.__table__.insert(), attacks)
+    session.commit()
+    return sensor_nodes
+
+
+def insert_samples(session, sensor_nodes: Dict[int, int], start_ts: float, end_ts: float, rate: float, rng) -> int:
+    timestamps: np.ndarray = np.arange(start_ts, end_ts, 1. / rate)
+    rows: List[dict] = []
+    for sensor_id, node_id in sensor_nodes.items():
+        values: np.ndarray = np.sin(timestamps / 3.) + rng.normal(0, 0.1, len(timestamps))
+        rows.extend({"timestamp": float(t), "value": float(v), "sensor_id": sensor_id, "node_id": node_id}
+                    for t, v in zip(timestamps, values))
+    for i in range(0, len(rows), 50000):
+        session.execute(Measurement.__table__.insert(), rows[i:i + 50000])
+    session.commit()
+    return len(rows)
+
+
+def summary(samples: List[float]) -> Dict[str, float]:
+    """ Returns the statistics of the given durations, in milliseconds """
+    array: np.ndarray = np.array(samples) * 1000.
+    return {
+        "mean_ms": float(array.mean()),
+        "p50_ms": float(np.percentile(array, 50)),
+        "p99_ms": float(np.percentile(array, 99)),
+        "max_ms": float(array.max())
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    if args.db.startswith("sqlite:///") and os.path.exists(args.db[len("sqlite:///"):]):
+        os.remove(args.db[len("sqlite:///"):])
+    cfg.db_path = args.db  # Must be set before data_query is imported
+    session = create_sessions(args.db)
+    Measurement.metadata.create_all(session.get_bind())
+    end_ts: float = time.time()
+    seed_start: float = time.perf_counter()
+    sensor_nodes: Dict[int, int] = seed(session, args, end_ts - args.window, end_ts)
+    seed_time: float = time.perf_counter() - seed_start
+    rng = np.random.RandomState(args.seed + 1)
+
+    import pyqtgraph as pg
+    import app
+    from fetch_worker import FetchWorker
+    from instrumentation import stats
+
+    qapp = pg.QtGui.QApplication(sys.argv)
+    window = app.PlotsWindow(args.ticks + 1, True, qapp)
+    while not window.discovered:
+        qapp.processEvents()
+        time.sleep(0.01)
+    # Drive the fetches and frames by hand, in this thread
+    window.stopWorker()
+    window.scheduler.stop()
+    window.setBuffer(args.window)
+    worker = FetchWorker(window.buffer)
+    worker.setVisibleSensors(window.getVisibleSensors())
+    worker.setResolution(window.resolution())
+    batches: list = []
+    worker.dataReady.connect(batches.append)
+
+    query_times: List[float] = []
+    transform_times: List[float] = []
+    render_times: List[float] = []
+    tick_times: List[float] = []
+    rows_per_tick: List[int] = []
+    for tick in range(args.ticks):
+        if tick != 0:
+            # Simulate the data produced since the previous tick
+            insert_samples(session, sensor_nodes, end_ts, end_ts + args.tick_interval, args.rate, rng)
+            end_ts += args.tick_interval
+        start: float = time.perf_counter()
+        worker.poll()
+        query_end: float = time.perf_counter()
+        for batch in batches:
+            window.receiveData(batch)
+        transform_end: float = time.perf_counter()
+        window.drawPlots()
+        qapp.processEvents()
+        render_end: float = time.perf_counter()
+        rows_per_tick.append(sum(len(d[0]) for b in batches for n in b.data.values() for d in n.values()))
+        batches.clear()
+        query_times.append(query_end - start)
+        transform_times.append(transform_end - query_end)
+        render_times.append(render_end - transform_end)
+        tick_times.append(render_end - start)
+
+    report: dict = {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "seed_s": seed_time,
+        "startup_ms": {name[len("startup."):]: summary["max"] for name, summary in stats.snapshot().items()
+                       if name.startswith("startup.") and "max" in summary},
+        "first_tick_ms": tick_times[0] * 1000.,
+        "rows_per_tick": float(np.mean(rows_per_tick[1:])) if args.ticks > 1 else float(rows_per_tick[0]),
+        # The first tick fetches the whole window and is reported separately
+        "query": summary(query_times[1:] or query_times),
+        "transform": summary(transform_times[1:] or transform_times),
+        "render": summary(render_times[1:] or render_times),
+        "tick": summary(tick_times[1:] or tick_times),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+    output: str = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
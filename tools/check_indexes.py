@@ -0,0 +1,181 @@
+# Checks that the queries issued by the plotter are served by indexes (PostgreSQL only).
+# Runs EXPLAIN ANALYZE on each query shape of data_query and flags the sequential scans of the measurement and attack tables,
+# and of the partitions of the hot table when hot_storage.py is installed.
+# With --create, creates the recommended indexes and reports the latency before and after.
+# Seed a database first with gen_test.py --bulk to get meaningful timings.
+# Run from the repository root: python tools/check_indexes.py --create
+
+import argparse
+import json
+import os
+import sys
+from typing import List, Dict, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app_config as cfg  # noqa: E402
+
+# Recommended indexes: name, table, definition
+INDEXES: List[Tuple[str, str, str]] = [
+    ("plotter_measurement_sensor_ts", "{measurements}", 'USING btree ("{sensor_id}", "{timestamp}")'),
+    ("plotter_attack_node_ts", "{attacks}", 'USING btree ("{node_id}", "{timestamp}")'),
+    # For the slices aggregated by rollup.py, which also creates it
+    ("plotter_measurement_ts", "{measurements}", 'USING btree ("{timestamp}")'),
+]
+# Optional, much smaller than a btree on append-only tables, for the queries on timestamps alone
+BRIN_INDEXES: List[Tuple[str, str, str]] = [
+    ("plotter_measurement_ts_brin", "{measurements}", 'USING brin ("{timestamp}")'),
+]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Checks the plotter queries against the database indexes")
+    parser.add_argument("--db", default=cfg.db_path, help="database URL")
+    parser.add_argument("--sensors", type=int, default=10, help="number of sensors queried at once")
+    parser.add_argument("--window", type=float, default=60., help="queried window (s)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each query, the fastest is reported")
+    parser.add_argument("--create", action="store_true", help="create the missing recommended indexes, then check again")
+    parser.add_argument("--brin", action="store_true", help="also create a BRIN index on the measurement timestamps")
+    return parser.parse_args()
+
+
+def query_shapes(sensor_ids: List[int], node_ids: List[int], end_ts: float, window: float) -> Dict[str, str]:
+    """ Returns the SQL of each kind of query issued by the plotter, with literal parameters.
+    The queries are built by the same functions as the plotter's """
+    from bookkeeper.sql import Measurement
+    import data_query as dq
+    import hot_storage
+    import rollup
+
+    engine = dq.session.get_bind()
+    start_ts: float = end_ts - window
+    width: float = window / cfg.decimation_buckets
+    measurements = Measurement.__table__
+    queries: dict = {
+        "metadata": dq.metadata_query(),
+        # Run when prepared statements are not supported, same plan as the "measurements" shape otherwise
+        "measurements_query": dq.measurements_after_ts_query(measurements, sensor_ids, start_ts),
+        "measurements_range": dq.measurements_between_ts_query(measurements, sensor_ids, start_ts, end_ts),
+        "decimated": dq.aggregate_buckets_query(measurements, sensor_ids, start_ts, end_ts, start_ts, width),
+        "attacks_range": dq.attacks_between_ts_query(node_ids, start_ts, end_ts),
+        # A slice of the finest rollup, as aggregated by rollup.py from the raw measurements
+        "rollup_slice": rollup.slice_query(None, min(rollup.rollup_tables.keys()), end_ts - cfg.rollup_slice, end_ts,
+                                           engine.dialect.name),
+    }
+    if rollup.tables_exist(engine):
+        finest = rollup.rollup_tables[min(rollup.rollup_tables.keys())]
+        queries["decimated_rollup"] = dq.aggregate_buckets_query(finest, sensor_ids, start_ts, end_ts, start_ts, width)
+    hot_installed: bool = hot_storage.supported(engine) and hot_storage.tables_exist(engine)
+    if hot_installed:
+        # The same queries, when the window is held by the hot table
+        hot = hot_storage.hot_table
+        queries["measurements_range_hot"] = dq.measurements_between_ts_query(hot, sensor_ids, start_ts, end_ts)
+        queries["decimated_hot"] = dq.aggregate_buckets_query(hot, sensor_ids, start_ts, end_ts, start_ts, width)
+    shapes: Dict[str, str] = {name: str(query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+                              for name, query in queries.items()}
+    # The per-tick queries, as run through prepared statements
+    shapes["measurements"] = dq.MEASUREMENTS_AFTER_TS_SQL.replace("$1::integer[]", "ARRAY%s::integer[]" % sensor_ids).\
+        replace("$2", repr(start_ts))
+    if hot_installed:
+        shapes["measurements_hot"] = dq.MEASUREMENTS_HOT_AFTER_TS_SQL.\
+            replace("$1::integer[]", "ARRAY%s::integer[]" % sensor_ids).replace("$2", repr(start_ts))
+    shapes["attacks"] = dq.ATTACKS_AFTER_TS_SQL.replace("$1::integer[]", "ARRAY%s::integer[]" % node_ids).\
+        replace("$2", repr(start_ts))
+    return shapes
+
+
+def seq_scans(plan: dict, tables: List[str]) -> List[str]:
+    """ Returns the tables of the given ones, or of their partitions, read with a sequential scan somewhere in the plan """
+    scans: List[str] = []
+    if plan.get("Node Type") == "Seq Scan":
+        relation: str = plan.get("Relation Name", "")
+        parent, _, suffix = relation.rpartition("_")
+        if relation in tables or (parent in tables and suffix.isdigit()):
+            scans.append(relation)
+    for child in plan.get("Plans", []):
+        scans.extend(seq_scans(child, tables))
+    return scans
+
+
+def explain(connection, shapes: Dict[str, str], tables: List[str], repeat: int) -> Dict[str, dict]:
+    """ Runs EXPLAIN ANALYZE on each query and returns its fastest execution time and its sequential scans """
+    results: Dict[str, dict] = {}
+    for name, sql in shapes.items():
+        times: List[float] = []
+        plan: dict = {}
+        for _ in range(repeat):
+            output = connection.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql).scalar()
+            explained: dict = (json.loads(output) if isinstance(output, str) else output)[0]
+            times.append(explained["Execution Time"])
+            plan = explained["Plan"]
+        results[name] = {"ms": min(times), "seq_scans": sorted(set(seq_scans(plan, tables)))}
+    return results
+
+
+def print_results(title: str, results: Dict[str, dict], before: Dict[str, dict] = None) -> None:
+    print(title)
+    for name, result in results.items():
+        line: str = "  %-24s %10.2f ms" % (name, result["ms"])
+        if before is not None:
+            line += "  (was %.2f ms, x%.1f)" % (before[name]["ms"], before[name]["ms"] / max(result["ms"], 1e-3))
+        if len(result["seq_scans"]) != 0:
+            line += "  SEQUENTIAL SCAN on %s" % ", ".join(result["seq_scans"])
+        print(line)
+
+
+def create_indexes(engine, indexes: List[Tuple[str, str, str]], names: Dict[str, str]) -> None:
+    """ Creates the given indexes without locking the tables against writes """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for index, table, definition in indexes:
+            print("Creating %s" % index)
+            connection.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS "%s" ON "%s" %s' % (
+                index, table.format(**names), definition.format(**names)))
+        for table in (names["measurements"], names["attacks"]):
+            connection.execute('ANALYZE "%s"' % table)
+
+
+def main() -> None:
+    args = parse_args()
+    cfg.db_path = args.db  # Must be set before data_query is imported
+    import data_query as dq
+    import hot_storage
+    import rollup
+    from sqlalchemy import func
+    from bookkeeper.sql import Measurement, Attack, Sensor
+
+    engine = dq.session.get_bind()
+    if engine.dialect.name != "postgresql":
+        print("Only PostgreSQL is supported")
+        sys.exit(1)
+    sensors: List[Tuple[int, int]] = dq.session.query(Sensor.id, Sensor.node_id).\
+        order_by(Sensor.node_id, Sensor.id).limit(args.sensors).all()
+    end_ts: float = dq.session.query(func.max(Measurement.timestamp)).scalar()
+    dq.session.close()
+    if len(sensors) == 0 or end_ts is None:
+        print("No measurements to query, seed the database first (gen_test.py --bulk)")
+        sys.exit(1)
+    sensor_ids: List[int] = [s[0] for s in sensors]
+    node_ids: List[int] = sorted(set(s[1] for s in sensors))
+    names: Dict[str, str] = {
+        "measurements": Measurement.__table__.name, "attacks": Attack.__table__.name,
+        "sensor_id": Measurement.__table__.c.sensor_id.name, "node_id": Attack.__table__.c.node_id.name,
+        "timestamp": Measurement.__table__.c.timestamp.name}
+    tables: List[str] = [names["measurements"], names["attacks"], hot_storage.hot_table.name] + \
+        [table.name for table in rollup.rollup_tables.values()]
+    shapes: Dict[str, str] = query_shapes(sensor_ids, node_ids, end_ts, args.window)
+
+    with engine.connect() as connection:
+        before: Dict[str, dict] = explain(connection, shapes, tables, args.repeat)
+    print_results("Current indexes:", before)
+    if not args.create:
+        if any(len(r["seq_scans"]) != 0 for r in before.values()):
+            print("Run with --create to create the recommended indexes")
+        return
+    create_indexes(engine, INDEXES + (BRIN_INDEXES if args.brin else []), names)
+    with engine.connect() as connection:
+        after: Dict[str, dict] = explain(connection, shapes, tables, args.repeat)
+    print_results("With the recommended indexes:", after, before)
+
+
+if __name__ == "__main__":
+    main()